@@ -1,15 +1,38 @@
+import asyncio
 import datetime
+import os
 import time
 import threading
 import socket
 import json
-import random
+import atexit
 import subprocess
 import shutil
-from rpi_ws281x import PixelStrip, Color
+import collections
+import itertools
+import bisect
+import hashlib
+import gzip
+import mimetypes
+import mmap
+import re
+import struct
+import multiprocessing
+import multiprocessing.shared_memory
+import queue
+import signal
+import numpy as np
+try:
+    from rpi_ws281x import PixelStrip
+except ImportError:  # Off the Pi only the virtual and null output backends are available
+    PixelStrip = None
 from astral import LocationInfo
 from astral.sun import sun
-from flask import Flask, request, render_template_string, jsonify
+try:
+    import brotli
+except ImportError:  # Optional; without it the dashboard is served gzip-compressed
+    brotli = None
+from flask import Flask, request, jsonify, g
 from flask_httpauth import HTTPBasicAuth
 from flask_socketio import SocketIO, emit
 
@@ -38,6 +61,12 @@ CUSTOM_SOLID_COLOR = (255, 0, 0)  # Default red
 # Effect speed multiplier (new feature: adjustable speed for effects, 1.0 = normal)
 EFFECT_SPEED = 1.0
 
+# Output calibration: gamma curve, per-channel white balance (0-1 scale on
+# R, G, B) and the order the strip expects the channels in
+GAMMA = 2.2
+WHITE_BALANCE = (1.0, 1.0, 1.0)
+CHANNEL_ORDER = 'RGB'
+
 # Persistence file (new feature: save/load settings)
 CONFIG_FILE = 'led_config.json'
 
@@ -48,28 +77,162 @@ BT_MAC = '2C:41:A1:66:59:5A'
 # Music process (global to control playback)
 music_process = None
 
+# Config store: save_config() only hands the settings over; they are
+# written in the background once no save has come in for
+# CONFIG_DEBOUNCE_S (or CONFIG_MAX_DELAY_S after the first unwritten one),
+# so a slider drag costs one SD card write instead of dozens. Writes are
+# atomic (temp file, fsync, rename over CONFIG_FILE, fsync the directory)
+# and the version being replaced is kept as CONFIG_FILE.1 (newest) to
+# .CONFIG_HISTORY. At boot the first of these that parses is used.
+CONFIG_DEBOUNCE_S = 1.0
+CONFIG_MAX_DELAY_S = 5.0
+CONFIG_HISTORY = 3
+
+config_stats = {'saves': 0, 'writes': 0, 'write_errors': 0}
+
+def config_versions():
+    return [CONFIG_FILE] + [f'{CONFIG_FILE}.{k}' for k in range(1, CONFIG_HISTORY + 1)]
+
+# The newest saved config that parses, and the file it came from
+def read_config():
+    for path in config_versions():
+        try:
+            with open(path, 'r') as f:
+                config = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if isinstance(config, dict):
+            return config, path
+    return None, None
+
+def write_file_atomic(path, data):
+    temp = path + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)  # Make the rename itself durable
+    finally:
+        os.close(directory)
+
+class ConfigStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.pending = None        # Settings waiting to be written
+        self.first_pending = None  # When the oldest unwritten save came in
+        self.last_save = None
+        self.written = None        # The known-good file contents: as last written, or loaded at boot
+        self.thread = None
+
+    def save(self, config):
+        with self.lock:
+            now = time.monotonic()
+            if self.pending is None:
+                self.first_pending = now
+            self.pending = config
+            self.last_save = now
+            config_stats['saves'] += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        self.wake.set()
+
+    def run(self):
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            while True:
+                with self.lock:
+                    if self.pending is None:
+                        break
+                    due = min(self.last_save + CONFIG_DEBOUNCE_S, self.first_pending + CONFIG_MAX_DELAY_S)
+                wait = due - time.monotonic()
+                if wait <= 0:
+                    self.flush()
+                    break
+                time.sleep(wait)
+
+    # Write pending settings now (also run at exit)
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                config, self.pending = self.pending, None
+            if config is None:
+                return
+            data = json.dumps(config).encode('utf-8')
+            if data == self.written:
+                return
+            try:
+                if self.written is not None:
+                    for k in range(CONFIG_HISTORY, 1, -1):
+                        if os.path.exists(f'{CONFIG_FILE}.{k - 1}'):
+                            os.replace(f'{CONFIG_FILE}.{k - 1}', f'{CONFIG_FILE}.{k}')
+                    write_file_atomic(f'{CONFIG_FILE}.1', self.written)
+                write_file_atomic(CONFIG_FILE, data)
+                self.written = data
+                config_stats['writes'] += 1
+            except OSError as e:
+                print(f"Saving config failed: {e}")
+                config_stats['write_errors'] += 1
+                with self.lock:
+                    if self.pending is None:  # Try again with the next save or at exit
+                        self.pending = config
+                        self.first_pending = self.last_save = time.monotonic()
+
+config_store = ConfigStore()
+atexit.register(config_store.flush)
+
 # Load saved config if exists
 def load_config():
-    global LED_COUNT, LED_BRIGHTNESS, SELECTED_EFFECT, location, TURN_OFF_HOUR, TURN_OFF_MINUTE, CUSTOM_SOLID_COLOR, EFFECT_SPEED
-    try:
-        with open(CONFIG_FILE, 'r') as f:
-            config = json.load(f)
-            LED_COUNT = config.get('led_count', LED_COUNT)
-            LED_BRIGHTNESS = config.get('brightness', LED_BRIGHTNESS)
-            SELECTED_EFFECT = config.get('effect', SELECTED_EFFECT)
-            location = LocationInfo(
-                config.get('loc_name', location.name),
-                config.get('loc_region', location.region),
-                config.get('loc_timezone', location.timezone),
-                config.get('loc_lat', location.latitude),
-                config.get('loc_lon', location.longitude)
-            )
-            TURN_OFF_HOUR = config.get('turn_off_hour', TURN_OFF_HOUR)
-            TURN_OFF_MINUTE = config.get('turn_off_minute', TURN_OFF_MINUTE)
-            CUSTOM_SOLID_COLOR = tuple(config.get('custom_solid_color', CUSTOM_SOLID_COLOR))
-            EFFECT_SPEED = config.get('effect_speed', EFFECT_SPEED)
-    except FileNotFoundError:
-        pass
+    global LED_COUNT, LED_BRIGHTNESS, SELECTED_EFFECT, location, TURN_OFF_HOUR, TURN_OFF_MINUTE, CUSTOM_SOLID_COLOR, EFFECT_SPEED, KEEPALIVE_S
+    global GAMMA, WHITE_BALANCE, CHANNEL_ORDER, NOISE_SEED, PLAGUE_SEEDS, PLAGUE_SPREAD_RATE
+    global SNAKE_COUNT, COMET_COUNT, SNOWFLAKE_COUNT, ZONES, LAYERS, EFFECT_CROSSFADE_S
+    global PREVIEW_FPS, PREVIEW_MAX_PIXELS
+    config, path = read_config()
+    if config is not None:
+        LED_COUNT = config.get('led_count', LED_COUNT)
+        LED_BRIGHTNESS = config.get('brightness', LED_BRIGHTNESS)
+        SELECTED_EFFECT = config.get('effect', SELECTED_EFFECT)
+        location = LocationInfo(
+            config.get('loc_name', location.name),
+            config.get('loc_region', location.region),
+            config.get('loc_timezone', location.timezone),
+            config.get('loc_lat', location.latitude),
+            config.get('loc_lon', location.longitude)
+        )
+        TURN_OFF_HOUR = config.get('turn_off_hour', TURN_OFF_HOUR)
+        TURN_OFF_MINUTE = config.get('turn_off_minute', TURN_OFF_MINUTE)
+        CUSTOM_SOLID_COLOR = tuple(config.get('custom_solid_color', CUSTOM_SOLID_COLOR))
+        EFFECT_SPEED = config.get('effect_speed', EFFECT_SPEED)
+        EFFECT_FPS.update(config.get('effect_fps', {}))
+        KEEPALIVE_S = config.get('keepalive_s', KEEPALIVE_S)
+        GAMMA = config.get('gamma', GAMMA)
+        WHITE_BALANCE = tuple(config.get('white_balance', WHITE_BALANCE))
+        CHANNEL_ORDER = config.get('channel_order', CHANNEL_ORDER)
+        NOISE_SEED = config.get('noise_seed', NOISE_SEED)
+        PLAGUE_SEEDS = config.get('plague_seeds', PLAGUE_SEEDS)
+        PLAGUE_SPREAD_RATE = config.get('plague_spread_rate', PLAGUE_SPREAD_RATE)
+        SNAKE_COUNT = config.get('snake_count', SNAKE_COUNT)
+        COMET_COUNT = config.get('comet_count', COMET_COUNT)
+        SNOWFLAKE_COUNT = config.get('snowflake_count', SNOWFLAKE_COUNT)
+        ZONES = config.get('zones', ZONES)
+        LAYERS = config.get('layers', LAYERS)
+        EFFECT_CROSSFADE_S = config.get('crossfade_s', EFFECT_CROSSFADE_S)
+        PREVIEW_FPS = min(max(float(config.get('preview_fps', PREVIEW_FPS)), 1.0), PREVIEW_MAX_FPS)
+        PREVIEW_MAX_PIXELS = min(max(int(config.get('preview_max_pixels', PREVIEW_MAX_PIXELS)), 1), PREVIEW_PIXEL_LIMIT)
+        if path == CONFIG_FILE:
+            config_store.written = json.dumps(config).encode('utf-8')
+        else:
+            print(f"{CONFIG_FILE} missing or unreadable, loaded {path}")
+            save_config()  # Restore it; the backups stay as they are
+    build_output_lut()
+    seed_noise(NOISE_SEED)
+    params.load_globals()
 
 # Save config
 def save_config():
@@ -85,17 +248,310 @@ def save_config():
         'turn_off_hour': TURN_OFF_HOUR,
         'turn_off_minute': TURN_OFF_MINUTE,
         'custom_solid_color': list(CUSTOM_SOLID_COLOR),
-        'effect_speed': EFFECT_SPEED
+        'effect_speed': EFFECT_SPEED,
+        'effect_fps': EFFECT_FPS,
+        'keepalive_s': KEEPALIVE_S,
+        'backend': BACKEND_SETTING,
+        'render_process': RENDER_PROCESS_SETTING,
+        'gamma': GAMMA,
+        'white_balance': list(WHITE_BALANCE),
+        'channel_order': CHANNEL_ORDER,
+        'noise_seed': NOISE_SEED,
+        'plague_seeds': PLAGUE_SEEDS,
+        'plague_spread_rate': PLAGUE_SPREAD_RATE,
+        'snake_count': SNAKE_COUNT,
+        'comet_count': COMET_COUNT,
+        'snowflake_count': SNOWFLAKE_COUNT,
+        'zones': ZONES,
+        'layers': LAYERS,
+        'crossfade_s': EFFECT_CROSSFADE_S,
+        'preview_fps': PREVIEW_FPS,
+        'preview_max_pixels': PREVIEW_MAX_PIXELS
     }
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config, f)
+    config_store.save(config)
+
+# Virtual output backend: an in-memory strip with the PixelStrip interface
+# that records every shown frame and the time of each show() call
+VIRTUAL_HISTORY = 1000  # Frames kept by the virtual strip
+
+class VirtualStrip:
+    def __init__(self, num, *args, **kwargs):
+        self.pixels = np.zeros(num, dtype=np.uint32)
+        self.brightness = 255
+        self.frames = collections.deque(maxlen=VIRTUAL_HISTORY)  # (monotonic time, packed frame)
+        self.show_count = 0
+        self.show_seconds = 0.0  # Total time spent inside show()
+
+    def begin(self):
+        pass
+
+    def numPixels(self):
+        return len(self.pixels)
+
+    def setPixelColor(self, n, color):
+        self.pixels[n] = color
+
+    def getPixelColor(self, n):
+        return int(self.pixels[n])
+
+    # Bulk path used by write_pixels()
+    def write_packed(self, start, values):
+        self.pixels[start:start + len(values)] = values
+
+    def setBrightness(self, brightness):
+        self.brightness = brightness
+
+    def getBrightness(self):
+        return self.brightness
+
+    def show(self):
+        started = time.monotonic()
+        self.frames.append((started, self.pixels.copy()))
+        self.show_count += 1
+        self.show_seconds += time.monotonic() - started
+
+# Null output backend: accepts frames and discards them, for raw throughput tests
+class NullStrip(VirtualStrip):
+    def setPixelColor(self, n, color):
+        pass
+
+    def write_packed(self, start, values):
+        pass
+
+    def show(self):
+        self.show_count += 1
+
+# Settings needed before the config is loaded, read straight from the file
+def saved_setting(key, default):
+    config, _ = read_config()
+    return default if config is None else config.get(key, default)
+
+# Output backend: 'ws281x' (the real strip), 'virtual' or 'null'. The
+# LIGHTS_BACKEND environment variable overrides 'backend' in the config file.
+BACKEND_SETTING = saved_setting('backend', 'ws281x')
+OUTPUT_BACKEND = os.environ.get('LIGHTS_BACKEND') or BACKEND_SETTING
+
+# Render in a separate process (see RenderProcess): 'render_process' in the
+# config file, overridden by LIGHTS_RENDER_PROCESS=1 or 0
+RENDER_PROCESS_SETTING = saved_setting('render_process', False)
+RENDER_PROCESS = os.environ.get('LIGHTS_RENDER_PROCESS', '1' if RENDER_PROCESS_SETTING else '0') == '1'
+
+# Create the strip object for the selected backend
+def create_strip(count):
+    if OUTPUT_BACKEND == 'virtual':
+        new_strip = VirtualStrip(count)
+    elif OUTPUT_BACKEND == 'null':
+        new_strip = NullStrip(count)
+    elif OUTPUT_BACKEND == 'ws281x':
+        if PixelStrip is None:
+            raise RuntimeError("rpi_ws281x is not installed; set LIGHTS_BACKEND=virtual or null to run without GPIO")
+        new_strip = PixelStrip(count, LED_PIN, LED_FREQ_HZ, LED_DMA, LED_INVERT, 255, LED_CHANNEL)
+    else:
+        raise ValueError("Unknown output backend: " + OUTPUT_BACKEND)
+    new_strip.begin()
+    new_strip.setBrightness(255)  # Brightness is applied by the output lookup tables
+    return new_strip
 
 # Create NeoPixel object with appropriate configuration
-strip = PixelStrip(LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA, LED_INVERT, LED_BRIGHTNESS, LED_CHANNEL)
-strip.begin()
+strip = create_strip(LED_COUNT)
+
+# Metrics: histograms of render-loop and control-route timings. Each keeps
+# cumulative bucket counts for Prometheus plus a ring of time slices so
+# recent percentiles cover only the last METRICS_WINDOW_S seconds.
+METRIC_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_WINDOW_S = 60
+METRICS_SLICES = 6
+
+class RollingHistogram:
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Cumulative; the last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.slice_s = METRICS_WINDOW_S / METRICS_SLICES
+        self.slices = [[-1, [0] * len(self.counts), 0.0] for _ in range(METRICS_SLICES)]  # [slice number, counts, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        number = int(time.monotonic() / self.slice_s)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+            entry = self.slices[number % METRICS_SLICES]
+            if entry[0] != number:
+                entry[0] = number
+                entry[1] = [0] * len(self.counts)
+                entry[2] = 0.0
+            entry[1][i] += 1
+            entry[2] += value
+
+    # Bucket counts and sum over the rolling window
+    def window(self):
+        oldest = int(time.monotonic() / self.slice_s) - METRICS_SLICES + 1
+        counts = [0] * len(self.counts)
+        total = 0.0
+        with self.lock:
+            for number, slice_counts, slice_sum in self.slices:
+                if number >= oldest:
+                    counts = [a + b for a, b in zip(counts, slice_counts)]
+                    total += slice_sum
+        return counts, total
+
+    # Snapshot and restore, to carry metrics recorded in the render process
+    def state(self):
+        with self.lock:
+            return self.counts[:], self.sum, self.count, [[n, c[:], total] for n, c, total in self.slices]
+
+    def load_state(self, state):
+        counts, total, count, slices = state
+        with self.lock:
+            self.counts, self.sum, self.count, self.slices = counts, total, count, slices
+
+    # Quantile over the rolling window, interpolated inside its bucket
+    def quantile(self, q):
+        counts, _ = self.window()
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        lower = 0.0
+        for bound, c in zip(self.buckets + (self.buckets[-1],), counts):
+            if c and seen + c >= rank:
+                return lower + (bound - lower) * (rank - seen) / c
+            seen += c
+            lower = bound
+        return self.buckets[-1]
+
+metrics = {
+    'render_seconds': RollingHistogram(),          # Effect render() time per frame
+    'show_seconds': RollingHistogram(),            # strip.show() latency
+    'frame_interval_seconds': RollingHistogram(),  # Time between rendered frames
+    'effect_stop_seconds': RollingHistogram(),     # stop_current_effect() until the loop is idle
+    'effect_start_seconds': RollingHistogram(),    # start_effect() until the new effect's first frame
+    'preview_seconds': RollingHistogram(),         # Live preview sample and encode per preview frame
+}
+METRIC_HELP = {
+    'render_seconds': 'Effect render time per frame',
+    'show_seconds': 'strip.show() latency',
+    'frame_interval_seconds': 'Time between rendered frames',
+    'effect_stop_seconds': 'Time from a stop request until the render loop is idle',
+    'effect_start_seconds': 'Time from an effect swap request until its first frame is shown',
+    'preview_seconds': 'Live preview sample and encode time per preview frame',
+}
+WEB_METRICS = ('preview_seconds',)  # Recorded in the web process, also when rendering in a render process
+request_metrics = {}  # Flask endpoint -> RollingHistogram of handler time
+command_metrics = {}  # Control command name -> RollingHistogram of time from queued to done
+frame_totals = {'frames': 0, 'late_frames': 0, 'dropped_frames': 0}  # Across all frame clocks
+
+# Frames per second over the rolling window
+def window_fps():
+    counts, total = metrics['frame_interval_seconds'].window()
+    return sum(counts) / total if total else 0.0
+
+# Framebuffer: effects draw into a (led_count, 3) uint8 RGB array instead of
+# calling setPixelColor per LED; show_frame() pushes it to the strip in bulk
+def new_framebuffer(count):
+    return np.zeros((count, 3), dtype=np.uint8)
+
+framebuffer = new_framebuffer(LED_COUNT)
+
+# Pack an (n, 3) RGB frame into 24-bit Color values
+def pack_frame(frame):
+    rgb = frame.astype(np.uint32)
+    return (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+
+# Output lookup tables: for each input channel (R, G, B), the packed 24-bit
+# contribution of every 0-255 value after gamma, white balance and global
+# brightness, already shifted into the channel's slot in CHANNEL_ORDER.
+# Rebuilt only when brightness or calibration changes.
+output_lut = None
+
+def build_output_lut():
+    global output_lut
+    levels = (np.arange(256) / 255.0) ** GAMMA
+    lut = np.empty((3, 256), dtype=np.uint32)
+    for channel, name in enumerate('RGB'):
+        scale = 255.0 * WHITE_BALANCE[channel] * LED_BRIGHTNESS / 255.0
+        shift = 16 - 8 * CHANNEL_ORDER.index(name)
+        lut[channel] = np.round(levels * scale).astype(np.uint32) << shift
+    output_lut = lut
+
+# Calibrate and pack an (n, 3) RGB frame in one vectorized pass
+def calibrate_frame(frame):
+    return output_lut[0][frame[:, 0]] | output_lut[1][frame[:, 1]] | output_lut[2][frame[:, 2]]
+
+build_output_lut()
+
+# Copy packed colors into the strip's LED buffer starting at pixel `start`.
+# On the real driver this maps ws2811_led_set straight over the values so the
+# copy runs without a Python frame per LED.
+def write_pixels(strip, start, values):
+    if hasattr(strip, 'write_packed'):
+        strip.write_packed(start, values)
+        return
+    positions = range(start, start + len(values))
+    values = values.tolist()
+    channel = getattr(strip, '_channel', None)
+    if channel is not None:
+        import _rpi_ws281x as ws
+        collections.deque(map(ws.ws2811_led_set, itertools.repeat(channel), positions, values), maxlen=0)
+    else:
+        collections.deque(map(strip.setPixelColor, positions, values), maxlen=0)
+
+# Re-send an unchanged frame at least this often (seconds), in case a pixel glitched
+KEEPALIVE_S = 1.0
+
+# Output stage state: the last frame pushed and when, plus push counters
+last_pushed = None
+last_pushed_strip = None
+last_push_time = 0.0
+output_stats = {'pushes': 0, 'skipped_pushes': 0}
+
+# Shadow framebuffer: the output stage's own copy of the last frame it was
+# given, before calibration. It is what the strip shows, so fades start from
+# it rather than from whatever a renderer left in the working framebuffer,
+# and nothing ever needs to be read back from the driver.
+shadow_frame = None
+
+# The frame currently on the strip, if the shadow matches this frame's size
+def shown_frame(frame):
+    if shadow_frame is not None and shadow_frame.shape == frame.shape:
+        return shadow_frame
+    return frame
+
+# Output stage: update the shadow copy, calibrate and pack the frame, compare it
+# with the last one pushed, copy only the changed pixel range into the strip's buffer, then show().
+# Identical frames skip show() entirely until the keep-alive interval has passed.
+def show_frame(strip, frame):
+    global last_pushed, last_pushed_strip, last_push_time, shadow_frame
+    if shadow_frame is None or shadow_frame.shape != frame.shape:
+        shadow_frame = frame.copy()
+    else:
+        np.copyto(shadow_frame, frame)
+    packed = calibrate_frame(frame)
+    now = time.monotonic()
+    if last_pushed_strip is strip and last_pushed is not None and len(last_pushed) == len(packed):
+        dirty = np.flatnonzero(packed != last_pushed)
+        if len(dirty) == 0 and now - last_push_time < KEEPALIVE_S:
+            output_stats['skipped_pushes'] += 1
+            return
+        start, end = (dirty[0], dirty[-1] + 1) if len(dirty) else (0, 0)
+    else:
+        start, end = 0, len(packed)
+    write_pixels(strip, int(start), packed[start:end])
+    show_started = time.monotonic()
+    strip.show()
+    metrics['show_seconds'].observe(time.monotonic() - show_started)
+    last_pushed = packed
+    last_pushed_strip = strip
+    last_push_time = now
+    output_stats['pushes'] += 1
 
 # Flask app for web control
-app = Flask(__name__)
+app = Flask(__name__, static_folder=None)  # Dashboard assets are served by serve_asset()
 app.config['SECRET_KEY'] = 'secret!'  # For SocketIO
 socketio = SocketIO(app)
 auth = HTTPBasicAuth()
@@ -128,6 +584,21 @@ users = {
     "admin": "password123"
 }
 
+# Time every Flask handler into request_metrics
+@app.before_request
+def start_request_timer():
+    g.request_started = time.monotonic()
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None and request.endpoint:
+        histogram = request_metrics.get(request.endpoint)
+        if histogram is None:
+            histogram = request_metrics.setdefault(request.endpoint, RollingHistogram())
+        histogram.observe(time.monotonic() - started)
+    return response
+
 @auth.verify_password
 def verify_password(username, password):
     if username in users and users[username] == password:
@@ -136,327 +607,1632 @@ def verify_password(username, password):
 # Global control variables
 manual_off = False
 manual_on = True
-stop_event = threading.Event()
-current_effect_thread = None
-current_effect_func = SELECTED_EFFECT
-
-# Helper function to set all pixels to a color
-def color_wipe(strip, color, wait_ms=50):
-    wait_ms /= EFFECT_SPEED  # Adjust for speed
-    for i in range(strip.numPixels()):
-        strip.setPixelColor(i, color)
-        strip.show()
-        time.sleep(wait_ms / 1000.0)
+current_effect_func = SELECTED_EFFECT  # Program of the selected effect (see RenderLoop)
+
+# Live parameters: typed, range-checked values that effects read once per
+# frame from params.live, so the web can change them without restarting
+# the effect. A change ramps linearly from the current value to the new one
+# over the parameter's smooth_s. Parameters bound to a config global keep
+# that global (and so led_config.json) in step with the target value; a
+# saved value that is not usable at all falls back to the default.
+PARAM_SPECS = {
+    'speed': {'type': 'float', 'min': 0.5, 'max': 2.0, 'smooth_s': 0.5, 'global': 'EFFECT_SPEED', 'default': 1.0},
+    'solid.color': {'type': 'color', 'min': 0, 'max': 255, 'smooth_s': 0.5, 'global': 'CUSTOM_SOLID_COLOR', 'default': (255, 0, 0)},
+    'plague.spread_rate': {'type': 'int', 'min': 1, 'max': 100, 'smooth_s': 0.0, 'global': 'PLAGUE_SPREAD_RATE', 'default': 1},
+}
+
+class ParamStore:
+    def __init__(self, specs):
+        self.specs = specs
+        self.lock = threading.Lock()
+        self.ramps = {}  # name -> (from, to, started, smooth_s)
+        self.live = {}   # Values for the current frame, replaced whole by tick()
+        self.listeners = []  # Called with (name, value, smooth) after every set()
+
+    # Check and normalize a value for a parameter; raises ValueError
+    def check(self, name, value):
+        spec = self.specs.get(name)
+        if spec is None:
+            raise ValueError("Unknown parameter: " + name)
+        if spec['type'] == 'color':
+            value = tuple(int(x) for x in value)
+            if len(value) != 3:
+                raise ValueError(name + " must be r,g,b")
+        else:
+            value = int(value) if spec['type'] == 'int' else float(value)
+        for x in (value if spec['type'] == 'color' else (value,)):
+            if not spec['min'] <= x <= spec['max']:
+                raise ValueError(f"{name} must be between {spec['min']} and {spec['max']}")
+        return value
+
+    # Set a parameter's target; the ramp starts from its current value
+    def set(self, name, value, smooth=True):
+        value = self.check(name, value)
+        spec = self.specs[name]
+        now = time.monotonic()
+        with self.lock:
+            current = self.value(name, now) if name in self.ramps else value
+            self.ramps[name] = (current, value, now, spec['smooth_s'] if smooth else 0.0)
+        if 'global' in spec:
+            globals()[spec['global']] = value
+        self.tick(now)
+        for listener in self.listeners:
+            listener(name, value, smooth)
+        return value
+
+    def target(self, name):
+        return self.ramps[name][1]
+
+    def value(self, name, now):
+        start, end, started, smooth_s = self.ramps[name]
+        p = 1.0 if smooth_s <= 0 else min(1.0, (now - started) / smooth_s)
+        if p >= 1.0:
+            return end
+        if self.specs[name]['type'] == 'color':
+            return tuple(round(a + (b - a) * p) for a, b in zip(start, end))
+        value = start + (end - start) * p
+        return round(value) if self.specs[name]['type'] == 'int' else value
+
+    # Compute every parameter's value for this frame (called by the render loop)
+    def tick(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.live = {name: self.value(name, now) for name in self.ramps}
+
+    # The nearest value within a parameter's limits; raises ValueError or
+    # TypeError if it is not a number (or r,g,b) at all
+    def clamp(self, name, value):
+        spec = self.specs[name]
+        def fit(x):
+            x = float(x) if spec['type'] == 'float' else int(x)
+            return min(max(x, spec['min']), spec['max'])
+        if spec['type'] == 'color':
+            return tuple(fit(x) for x in value)
+        return fit(value)
+
+    # Take every bound parameter from its config global, without smoothing.
+    # Saved values may predate the limits: clamp them rather than refuse to start.
+    def load_globals(self):
+        for name, spec in self.specs.items():
+            if 'global' in spec:
+                value = globals()[spec['global']]
+                try:
+                    clamped = self.clamp(name, value)
+                except (TypeError, ValueError):
+                    clamped = spec['default']
+                if clamped != value:
+                    print(f"Saved {name} {value!r} is not valid, using {clamped!r}")
+                self.set(name, clamped, smooth=False)
+
+    def describe(self):
+        return {name: dict(spec, value=self.ramps[name][1] if name in self.ramps else None)
+                for name, spec in self.specs.items()}
+
+params = ParamStore(PARAM_SPECS)
+
+# Frame clock: paces frames to absolute deadlines on the monotonic clock.
+# Effects are factories that take the pixel count and return a
+# render(frame, t) function, where t is effect time in seconds. Effect time
+# accumulates frame by frame at the live 'speed' parameter, so a speed
+# change bends the animation instead of jumping it. The clock accounts for
+# render and show() time, and skips whole frames instead of falling behind
+# when it is late.
+class FrameClock:
+    def __init__(self, fps):
+        self.fps = fps
+        self.frames = 0          # Frames rendered and shown
+        self.late_frames = 0     # Frames that finished after their deadline
+        self.dropped_frames = 0  # Frames skipped to catch back up
+        self.start = time.monotonic()
+        self.deadline = self.start
+        self.t = 0.0             # Effect time of the frame due now
+
+    def effect_time(self):
+        return self.t
+
+    # Count a shown frame and move to the next deadline; returns the seconds
+    # to wait until it
+    def advance(self):
+        period = 1.0 / self.fps
+        self.frames += 1
+        frame_totals['frames'] += 1
+        previous = self.deadline
+        self.deadline += period
+        now = time.monotonic()
+        if now > self.deadline:
+            self.late_frames += 1
+            frame_totals['late_frames'] += 1
+            behind = int((now - self.deadline) / period)
+            if behind:
+                self.dropped_frames += behind
+                frame_totals['dropped_frames'] += behind
+                self.deadline += behind * period
+        self.t += (self.deadline - previous) * params.live.get('speed', 1.0)
+        return max(0.0, self.deadline - now)
+
+# Render loop: one long-lived thread that owns the strip. What it plays is a
+# program, a function of the pixel count returning (render, fps). play()
+# builds the renderer on the caller's thread (baking or opening files
+# there, while the old effect keeps running) and, like stop(), only posts
+# a request and wakes the loop. The loop swaps between two frames, so a
+# switch lands within one frame whatever the effect is doing. Each program renders into its own buffer, seeded with
+# the frame on the strip; with a crossfade the outgoing program keeps
+# rendering and the two are mixed until the new one has fully taken over.
+# A render returning False ends its program and the loop goes idle.
+class RenderLoop:
+    def __init__(self, publish=None):
+        self.publish = publish  # Called with every shown frame (see RenderProcess)
+        self.intervals = collections.deque(maxlen=FRAME_INTERVAL_HISTORY)  # Recent frame intervals, seconds
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.pending = None  # (render, fps, crossfade_s, requested_at) for the next frame boundary; render None = stop
+        self.thread = None
+        self.last_switch_seconds = None  # Most recent swap request to first frame shown
+
+    def post(self, render, fps, crossfade):
+        with self.lock:
+            self.pending = (render, fps, crossfade, time.monotonic())
+            if render is not None:
+                self.idle.clear()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        self.wake.set()
+
+    def play(self, program, crossfade=0.0):
+        try:
+            render, fps = program(len(framebuffer))
+        except Exception as e:  # e.g. a sequence file removed since it was chosen
+            print(f"Effect failed to start: {e}")
+            return
+        self.post(render, fps, crossfade)
+
+    def stop(self, timeout=None):
+        self.post(None, None, 0.0)
+        self.idle.wait(timeout)
+
+    # Same as RenderProcess.close(), for whichever one is in use at exit
+    def close(self, timeout=2.0):
+        self.stop(timeout)
+
+    # True while a program is playing (or about to)
+    def active(self):
+        return not self.idle.is_set()
+
+    def wait_idle(self, timeout=None):
+        return self.idle.wait(timeout)
+
+    # Push the frame on the strip again (after a brightness or calibration
+    # change) when no program is playing; a playing one picks it up anyway
+    def reshow(self):
+        with self.lock:
+            if self.idle.is_set() and shadow_frame is not None:
+                show_frame(strip, shadow_frame.copy())
+
+    # New strip and framebuffer for an LED count change
+    def resize(self, count):
+        global strip, framebuffer
+        with self.lock:
+            strip = create_strip(count)
+            framebuffer = new_framebuffer(count)
+
+    # The frame on the strip (not a copy)
+    def current_frame(self):
+        return shadow_frame
+
+    # A copy of the frame on the strip, never one half-way through a show
+    def copy_frame(self):
+        with self.lock:
+            return None if shadow_frame is None else shadow_frame.copy()
+
+    def recent_intervals(self):
+        return list(self.intervals)
+
+    def run(self):
+        current = None  # (render, buffer, clock) of the playing program
+        fading = None   # The same for the outgoing program during a crossfade
+        fade_started = fade_s = fade_offset = 0.0
+        requested = None  # When the playing program was requested, until its first frame
+        previous = None
+        while True:
+            with self.lock:
+                pending, self.pending = self.pending, None
+            if pending is not None:
+                render, fps, crossfade, requested_at = pending
+                if render is None:
+                    current = fading = None
+                    metrics['effect_stop_seconds'].observe(time.monotonic() - requested_at)
+                else:
+                    buffer = new_framebuffer(len(framebuffer))
+                    buffer[:] = shown_frame(buffer)  # Start from what the strip shows
+                    if crossfade > 0 and current is not None and len(current[1]) == len(buffer):
+                        fading = current
+                        fade_started = time.monotonic()
+                        fade_s = crossfade
+                        fade_offset = current[2].effect_time()  # The outgoing effect's time carries on
+                    else:
+                        fading = None
+                    current = (render, buffer, FrameClock(fps))
+                    requested = requested_at
+                    previous = None
+            if current is None:
+                with self.lock:
+                    if self.pending is None:
+                        self.idle.set()
+                self.wake.wait()
+                self.wake.clear()
+                continue
+
+            render, buffer, clock = current
+            render_started = time.monotonic()
+            try:
+                params.tick(render_started)
+                last = render(buffer, clock.effect_time()) is False  # False = final frame
+                output = buffer
+                if fading is not None:
+                    p = (render_started - fade_started) / fade_s
+                    if p >= 1.0:
+                        fading = None
+                    else:
+                        fading[0](fading[1], clock.effect_time() + fade_offset)
+                        np.copyto(framebuffer, fading[1] + (buffer.astype(np.float32) - fading[1]) * p, casting='unsafe')
+                        output = framebuffer
+                metrics['render_seconds'].observe(time.monotonic() - render_started)
+                if previous is not None:
+                    metrics['frame_interval_seconds'].observe(render_started - previous)
+                    self.intervals.append(render_started - previous)
+                previous = render_started
+                with self.lock:
+                    if len(output) == len(framebuffer):  # Stale size after an LED count change
+                        show_frame(strip, output)
+                        if self.publish is not None:
+                            self.publish(output)
+                if requested is not None:
+                    self.last_switch_seconds = time.monotonic() - requested
+                    metrics['effect_start_seconds'].observe(self.last_switch_seconds)
+                    requested = None
+                if last and fading is None:
+                    current = None
+                    continue
+                wait = clock.advance()
+            except Exception as e:  # e.g. a corrupt sequence file or an fps of 0; drop the program, keep the loop
+                print(f"Effect failed: {e}")
+                current = fading = None
+                continue
+            self.wake.wait(wait)
+            self.wake.clear()
+
+FRAME_INTERVAL_HISTORY = 2000
+
+render_loop = RenderLoop()
+
+# Render process: the render loop and the strip in a child process of their
+# own, so Flask, Socket.IO and JSON work never hold the GIL the animation
+# needs (and heavy effects never slow the web UI). It has the RenderLoop
+# interface, so the rest of the app does not care which one it talks to.
+# Commands go down a pipe as (id, kind, *args) tuples; programs travel as
+# their picklable spec. The child reports back on a second pipe: whether it
+# is idle after which command, switch latency, frame counters and metric
+# snapshots. Every shown frame is published to shared memory, where the web
+# process can read it without a copy. The child is forked, so it inherits
+# the loaded config, palettes and the strip; start it before other threads.
+SHARED_FRAME_HEADER = 16  # uint64 sequence number (odd while a frame is being written), uint32 LED count, padding
+
+def create_shared_frame(count):
+    shm = multiprocessing.shared_memory.SharedMemory(create=True, size=SHARED_FRAME_HEADER + count * 3)
+    shm.buf[:SHARED_FRAME_HEADER] = struct.pack('<QI4x', 0, count)
+    return shm
+
+# Open a segment created by the parent. The forked child shares the
+# parent's resource tracker, so the segment stays registered once and the
+# parent's unlink() releases it.
+def attach_shared_frame(name):
+    return multiprocessing.shared_memory.SharedMemory(name=name)
+
+# (sequence view, frame view) over a shared frame segment
+def shared_frame_views(shm):
+    count = struct.unpack_from('<I', shm.buf, 8)[0]
+    seq = np.ndarray((1,), dtype=np.uint64, buffer=shm.buf)
+    frame = np.ndarray((count, 3), dtype=np.uint8, buffer=shm.buf, offset=SHARED_FRAME_HEADER)
+    return seq, frame
+
+def output_settings():
+    return LED_BRIGHTNESS, GAMMA, WHITE_BALANCE, CHANNEL_ORDER, KEEPALIVE_S
+
+def apply_output_settings(settings):
+    global LED_BRIGHTNESS, GAMMA, WHITE_BALANCE, CHANNEL_ORDER, KEEPALIVE_S
+    LED_BRIGHTNESS, GAMMA, WHITE_BALANCE, CHANNEL_ORDER, KEEPALIVE_S = settings
+    build_output_lut()
+
+# Rebuild a program from its spec (see the .spec attribute on programs)
+def program_from_spec(spec):
+    if spec[0] == 'transition':
+        return transition_program(*spec[1:])
+    if spec[0] == 'zones':
+        return get_zones_function(spec[1])
+    if spec[0] == 'layers':
+        return get_layers_function(spec[1])
+    return get_effect_function(spec[1])
+
+class RenderProcess:
+    def __init__(self):
+        context = multiprocessing.get_context('fork')
+        self.shm = create_shared_frame(len(framebuffer))
+        self.seq, self.frame = shared_frame_views(self.shm)
+        self.retired = []  # Segments replaced by a resize; views into them may still be alive
+        commands_out, self.commands = context.Pipe(duplex=False)
+        self.events, events_in = context.Pipe(duplex=False)
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.last_play = 0  # Id of the last play command; older idle reports are stale
+        self.playing = None  # Spec of the last program played, None after a stop
+        self.closing = False
+        self.idle = threading.Event()
+        self.idle.set()
+        self.replies = queue.Queue()
+        self.last_switch_seconds = None
+        self.process = context.Process(target=render_process_main, args=(commands_out, events_in, self.shm), daemon=True)
+        self.process.start()
+        commands_out.close()
+        events_in.close()
+        params.listeners.append(self.send_param)
+        self.listener = threading.Thread(target=self.listen, daemon=True)
+        self.listener.start()
+
+    def send(self, kind, *args):
+        with self.lock:
+            self.next_id += 1
+            if kind == 'play':
+                self.last_play = self.next_id
+                self.idle.clear()
+            self.commands.send((self.next_id, kind) + args)
+            return self.next_id
+
+    def play(self, program, crossfade=0.0):
+        self.playing = program.spec
+        self.send('play', program.spec, crossfade)
+
+    def stop(self, timeout=None):
+        self.playing = None
+        self.send('stop')
+        self.idle.wait(timeout)
+
+    def active(self):
+        return not self.idle.is_set()
+
+    def wait_idle(self, timeout=None):
+        return self.idle.wait(timeout)
+
+    # Pass brightness and calibration changes on; the child re-shows when idle
+    def reshow(self):
+        self.send('output', output_settings())
+
+    def send_param(self, name, value, smooth):
+        self.send('param', name, value, smooth)
+
+    def resize(self, count):
+        global framebuffer
+        framebuffer = new_framebuffer(count)
+        shm = create_shared_frame(count)
+        self.send('resize', count, shm.name)
+        self.retired.append(self.shm)
+        self.shm.unlink()
+        self.shm = shm
+        self.seq, self.frame = shared_frame_views(shm)
+        self.close_retired()
+
+    # Unmap replaced segments once no view into them is left (a reader
+    # part-way through copy_frame() keeps one until the next resize)
+    def close_retired(self):
+        held = []
+        for old in self.retired:
+            try:
+                old.close()
+            except BufferError:
+                held.append(old)
+        self.retired = held
+
+    # The last frame the child showed, as a view into shared memory. It may
+    # be mid-update; compare frame_seq() before and after (even, unchanged)
+    # for a consistent read.
+    def current_frame(self):
+        return self.frame
+
+    def frame_seq(self):
+        return int(self.seq[0])
+
+    # A consistent copy of the last frame the child showed, taken by the
+    # frame_seq() check above; None if the child kept writing over it
+    def copy_frame(self, attempts=10):
+        seq, frame = self.seq, self.frame  # A resize swaps both
+        for _ in range(attempts):
+            before = int(seq[0])
+            if before % 2 == 0:
+                copy = np.array(frame)
+                if int(seq[0]) == before:
+                    return copy
+            time.sleep(0)
+        return None
+
+    def recent_intervals(self, timeout=2.0):
+        request_id = self.send('intervals')
+        while True:
+            kind, reply_id, payload = self.replies.get(timeout=timeout)
+            if reply_id == request_id:
+                return payload
+
+    def listen(self):
+        while True:
+            try:
+                event = self.events.recv()
+            except (EOFError, OSError):
+                self.fall_back()
+                return
+            if event[0] == 'error':
+                _, command_id, kind, message = event
+                print(f"Render process: {kind} failed: {message}")
+            elif event[0] == 'status':
+                _, handled, active, switch_seconds, totals, stats, states = event
+                with self.lock:
+                    if handled >= self.last_play:
+                        if active:
+                            self.idle.clear()
+                        else:
+                            self.idle.set()
+                self.last_switch_seconds = switch_seconds
+                frame_totals.update(totals)
+                output_stats.update(stats)
+                for name, state in states.items():
+                    metrics[name].load_state(state)
+            else:
+                self.replies.put(event)
+
+    # The child is gone (killed, or crashed outside a command): render in
+    # this process from now on, picking up what was playing. Forking a new
+    # child is not safe once the web threads are running.
+    def fall_back(self):
+        global render_loop
+        if self.closing or render_loop is not self:
+            self.idle.set()
+            return
+        print("Render process exited; rendering in the web process")
+        if params.listeners.count(self.send_param):
+            params.listeners.remove(self.send_param)
+        loop = RenderLoop()
+        if strip.numPixels() != len(framebuffer):
+            loop.resize(len(framebuffer))
+        playing = None if self.idle.is_set() else self.playing
+        render_loop = loop
+        self.idle.set()
+        self.shm.unlink()
+        if playing is not None:
+            try:
+                loop.play(program_from_spec(playing))
+            except Exception as e:
+                print(f"Effect failed to start: {e}")
+
+    def close(self, timeout=2.0):
+        self.closing = True
+        try:
+            self.send('quit')
+        except OSError:
+            pass
+        self.process.join(timeout)
+        if params.listeners.count(self.send_param):
+            params.listeners.remove(self.send_param)
+        self.shm.unlink()
+        self.close_retired()
+
+# Child side of RenderProcess: run a RenderLoop that publishes into shared
+# memory and carry out commands until told to quit
+def render_process_main(commands, events, shm):
+    global render_loop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The parent turns the lights off and stops us
+    params.listeners = []
+    send_lock = threading.Lock()
+    handled = 0
+    views = list(shared_frame_views(shm))
+
+    def send(*event):
+        with send_lock:
+            events.send(event)
+
+    def publish(frame):
+        seq, shared = views
+        seq[0] += 1
+        shared[:len(frame)] = frame
+        seq[0] += 1
+
+    def report():
+        last = None
+        last_metrics = 0.0
+        while True:
+            state = (handled, render_loop.active(), render_loop.last_switch_seconds)
+            now = time.monotonic()
+            if state != last or now - last_metrics >= 1.0:
+                send('status', state[0], state[1], state[2], dict(frame_totals), dict(output_stats),
+                     {name: histogram.state() for name, histogram in metrics.items() if name not in WEB_METRICS})
+                last = state
+                last_metrics = now
+            time.sleep(0.02)
+
+    render_loop = RenderLoop(publish)
+    threading.Thread(target=report, daemon=True).start()
+    while True:
+        try:
+            command = commands.recv()
+        except EOFError:
+            break
+        command_id, kind, args = command[0], command[1], command[2:]
+        try:
+            if kind == 'play':
+                render_loop.play(program_from_spec(args[0]), args[1])
+            elif kind == 'stop':
+                render_loop.stop(STOP_TIMEOUT_S)
+            elif kind == 'param':
+                params.set(*args)
+            elif kind == 'output':
+                apply_output_settings(args[0])
+                render_loop.reshow()
+            elif kind == 'resize':
+                # Resize first: until the playing program is replaced its frames
+                # no longer match the framebuffer and are not published
+                render_loop.resize(args[0])
+                new_shm = attach_shared_frame(args[1])
+                with render_loop.lock:  # publish() runs under it, so no view into the old segment is in use
+                    views[:] = shared_frame_views(new_shm)
+                shm.close()
+                shm = new_shm
+            elif kind == 'intervals':
+                send('intervals', command_id, render_loop.recent_intervals())
+            elif kind == 'quit':
+                render_loop.stop(1.0)
+                break
+        except Exception as e:  # e.g. a sequence file removed since it was chosen; keep serving
+            send('error', command_id, kind, str(e))
+        handled = command_id
+
+# Target frames per second per effect (overridable via 'effect_fps' in the config)
+DEFAULT_FPS = 30
+EFFECT_FPS = {
+    'solid': 50,
+    'wipe': 40,
+    'chase': 20,
+    'rainbow': 50,
+    'snake': 20,
+    'plague': 10,
+    'random_multi': 10,
+    'twinkle': 20,
+    'fire_flicker': 20,
+    'phase_out': 20,
+    'michigan': 50,
+    'comets': 50,
+    'snow': 30,
+}
+
+# Palettes: 256-entry RGB lookup tables that effects sample by index instead
+# of computing colors per pixel. PACKED_PALETTES holds the same tables as
+# 24-bit Color values.
+def wheel_palette():
+    pos = np.arange(256)
+    rgb = np.zeros((256, 3), dtype=np.int16)
+    a = pos < 85
+    b = (pos >= 85) & (pos < 170)
+    c = pos >= 170
+    rgb[a, 0] = pos[a] * 3
+    rgb[a, 1] = 255 - pos[a] * 3
+    rgb[b, 0] = 255 - (pos[b] - 85) * 3
+    rgb[b, 2] = (pos[b] - 85) * 3
+    rgb[c, 1] = (pos[c] - 170) * 3
+    rgb[c, 2] = 255 - (pos[c] - 170) * 3
+    return rgb.astype(np.uint8)
+
+# Cyclic gradient through evenly spaced color stops (last stop blends back to the first)
+def gradient_palette(stops, size=256):
+    stops = np.array(stops, dtype=np.float32)
+    x = np.arange(size) * len(stops) / size
+    i = x.astype(int)
+    f = (x - i)[:, None]
+    return (stops[i] + (stops[(i + 1) % len(stops)] - stops[i]) * f + 0.5).astype(np.uint8)
+
+PALETTES = {
+    'rainbow': wheel_palette(),
+    'candy_cane': gradient_palette([(255, 0, 0), (255, 0, 0), (255, 255, 255), (255, 255, 255)]),
+    'maize_blue': gradient_palette([(200, 255, 0), (7, 23, 242)]),
+    'fire': gradient_palette([(255, 0, 0), (255, 69, 0), (255, 140, 0), (255, 165, 0), (255, 215, 0), (255, 165, 0), (255, 140, 0), (255, 69, 0)]),
+}
+PACKED_PALETTES = {name: pack_frame(palette) for name, palette in PALETTES.items()}
+
+# Color wheel position 0-255 to a 24-bit Color
+def wheel(pos):
+    return int(PACKED_PALETTES['rainbow'][pos & 255])
+
+# Rotation primitive: frame[i] = palette[(index[i] + offset) % len(palette)] as one vector gather
+def rotate_palette(frame, palette, index, offset):
+    np.take(palette, (index + offset) % len(palette), axis=0, out=frame, mode='clip')
+
+# Noise engine: whole-frame random fields, random walks and smooth value
+# noise from one seeded NumPy Generator, so per-frame cost is a handful of
+# vector calls instead of several Python random calls per LED. Set
+# NOISE_SEED (or 'noise_seed' in the config) for repeatable effects.
+NOISE_SEED = None
+NOISE_LATTICE_SIZE = 256
+
+def seed_noise(seed):
+    global noise_rng, noise_lattice
+    noise_rng = np.random.default_rng(seed)
+    noise_lattice = noise_rng.random((NOISE_LATTICE_SIZE, NOISE_LATTICE_SIZE), dtype=np.float32)
+
+seed_noise(NOISE_SEED)
+
+# Integers in [low, high) for n pixels (or an explicit shape)
+def random_field(shape, low, high, dtype=np.int16):
+    return noise_rng.integers(low, high, shape, dtype=dtype)
+
+# Floats in [low, high) for n pixels
+def uniform_field(shape, low=0.0, high=1.0):
+    return noise_rng.uniform(low, high, shape).astype(np.float32)
+
+# Step every value by a random amount in [-step, step] and clamp, in place
+def random_walk(values, step, low, high):
+    values += noise_rng.integers(-step, step + 1, len(values), dtype=values.dtype)
+    np.clip(values, low, high, out=values)
+    return values
+
+# Smooth 2D value noise in [0, 1) sampled along one lattice row: x is an
+# array (usually pixel position times a spatial scale) and y a scalar
+# (usually effect time times a temporal scale). Blending the two lattice
+# rows first leaves one 256-entry gather per octave however many pixels
+# there are. Each octave doubles the frequency at half the amplitude.
+def value_noise(x, y, octaves=1):
+    total = 0.0
+    amplitude = 1.0
+    norm = 0.0
+    mask = NOISE_LATTICE_SIZE - 1
+    for _ in range(octaves):
+        yf = np.floor(y)
+        v = y - yf
+        v = v * v * (3 - 2 * v)  # Smoothstep
+        row = noise_lattice[int(yf) & mask] * np.float32(1 - v) + noise_lattice[(int(yf) + 1) & mask] * np.float32(v)
+        xf = np.floor(x)
+        x0 = xf.astype(np.intp) & mask
+        u = x - xf
+        u = u * u * (3 - 2 * u)
+        left = row[x0]
+        total = total + amplitude * (left + (row[(x0 + 1) & mask] - left) * u)
+        norm += amplitude
+        amplitude *= 0.5
+        x = x * 2
+        y = y * 2
+    return total / norm
+
+# Transitions: each frame is computed from the frame at the start of the
+# transition and a target frame at progress p (0-1). Durations are fixed
+# wall-clock times, so a wipe takes the same time however many LEDs there
+# are and whatever the speed parameter is.
+TRANSITION_FPS = 50
+TURN_OFF_S = 0.5     # turn_off() wipe to black
+SOLID_WIPE_S = 1.0   # solid_color intro wipe
+PHASE_OUT_S = 2.5    # phase_out fade to black
+WIPE_EFFECT_S = 15.0  # One color wipe of the wipe effect
+
+def wipe_step(frame, start, target, p, order):
+    lit = int(p * len(frame))
+    frame[:lit] = target[:lit]
+    frame[lit:] = start[lit:]
+
+def crossfade_step(frame, start, target, p, order):
+    frame[:] = start + (target - start) * p
+
+def dissolve_step(frame, start, target, p, order):
+    np.copyto(frame, np.where((order < p * len(frame))[:, None], target, start), casting='unsafe')
+
+TRANSITIONS = {
+    'wipe': wipe_step,
+    'crossfade': crossfade_step,
+    'dissolve': dissolve_step,
+}
+
+# Renderer for a transition from the frame on the strip when it starts (the
+# shadow framebuffer) to target (an (n, 3) frame or one color); every frame is
+# computed from that snapshot, so nothing compounds. Returns False on the final frame.
+def transition_renderer(kind, target, duration):
+    step = TRANSITIONS[kind]
+    start = None
+    order = None
+    started = None
+    def render(frame, t):
+        nonlocal start, target, order, started
+        if start is None:
+            start = shown_frame(frame).astype(np.float32)
+            target = np.broadcast_to(np.asarray(target, dtype=np.float32), frame.shape)
+            order = noise_rng.permutation(len(frame))  # Dissolve order
+            started = time.monotonic()
+        p = min(1.0, (time.monotonic() - started) / duration) if duration > 0 else 1.0
+        step(frame, start, target, p, order)
+        return p < 1.0
+    return render
+
+# Render-loop program for a transition; the loop goes idle when it finishes
+def transition_program(kind, target, duration):
+    def program(num_pixels):
+        return transition_renderer(kind, target, duration), TRANSITION_FPS
+    program.spec = ('transition', kind, tuple(target), duration)
+    return program
 
 # Effect: Solid color (uses custom color)
-def solid_color(strip, stop_event):
-    r, g, b = CUSTOM_SOLID_COLOR
-    color_wipe(strip, Color(r, g, b), 10)
-    while not stop_event.is_set():
-        time.sleep(1)  # Keep lit
+def solid_color(num_pixels, color=None):
+    wipe = transition_renderer('wipe', params.live.get('solid.color', CUSTOM_SOLID_COLOR) if color is None else tuple(color), SOLID_WIPE_S)
+    wiping = True
+    def render(frame, t):
+        nonlocal wiping
+        if wiping:
+            wiping = wipe(frame, t)  # Wipe in
+        elif color is None:
+            frame[:] = params.live.get('solid.color', CUSTOM_SOLID_COLOR)  # Then follow the live color
+    return render
 
 # Effect: Color wipe (cycles through colors)
-def color_wipe_effect(strip, stop_event):
-    while not stop_event.is_set():
-        color_wipe(strip, Color(255, 0, 0), 50)  # Red wipe
-        if stop_event.is_set(): break
-        color_wipe(strip, Color(0, 255, 0), 50)  # Green wipe
-        if stop_event.is_set(): break
-        color_wipe(strip, Color(0, 0, 255), 50)  # Blue wipe
+WIPE_COLORS = [(255, 0, 0), (0, 255, 0), (0, 0, 255)]  # Red, green, blue wipes
+
+def color_wipe_effect(num_pixels):
+    colors = [np.full((num_pixels, 3), color, dtype=np.uint8) for color in WIPE_COLORS]
+    def render(frame, t):
+        wipe, u = divmod(t, WIPE_EFFECT_S)
+        color = int(wipe) % len(colors)
+        wipe_step(frame, colors[color - 1], colors[color], u / WIPE_EFFECT_S, None)
+    return render
 
 # Effect: Theater chase
-def theater_chase(strip, color, wait_ms=50, iterations=10):
-    wait_ms /= EFFECT_SPEED
-    for j in range(iterations):
-        if stop_event.is_set(): return
-        for q in range(3):
-            for i in range(0, strip.numPixels(), 3):
-                strip.setPixelColor(i + q, color)
-            strip.show()
-            time.sleep(wait_ms / 1000.0)
-            for i in range(0, strip.numPixels(), 3):
-                strip.setPixelColor(i + q, 0)
-
-def theater_chase_effect(strip, stop_event):
-    while not stop_event.is_set():
-        theater_chase(strip, Color(127, 127, 127))  # White
-        if stop_event.is_set(): break
-        theater_chase(strip, Color(127, 0, 0))      # Red
-        if stop_event.is_set(): break
-        theater_chase(strip, Color(0, 0, 127))      # Blue
+CHASE_COLORS = [(127, 127, 127), (127, 0, 0), (0, 0, 127)]  # White, red, blue
+CHASE_ITERATIONS = 10  # Turns of the 3-pixel pattern per color
+CHASE_STEP_S = 0.05
+
+def theater_chase_effect(num_pixels):
+    # One lit pixel in every three, as a 3-entry table per color
+    patterns = [np.array([color, (0, 0, 0), (0, 0, 0)], dtype=np.uint8) for color in CHASE_COLORS]
+    positions = np.arange(num_pixels)
+    def render(frame, t):
+        step = int(t / CHASE_STEP_S)
+        pattern = patterns[(step // (3 * CHASE_ITERATIONS)) % len(patterns)]
+        rotate_palette(frame, pattern, positions, -(step % 3))
+    return render
 
 # Effect: Rainbow cycle
-def wheel(pos):
-    if pos < 85:
-        return Color(pos * 3, 255 - pos * 3, 0)
-    elif pos < 170:
-        pos -= 85
-        return Color(255 - pos * 3, 0, pos * 3)
-    else:
-        pos -= 170
-        return Color(0, pos * 3, 255 - pos * 3)
-
-def rainbow_cycle(strip, wait_ms=20):
-    wait_ms /= EFFECT_SPEED
-    for j in range(256):
-        if stop_event.is_set(): return
-        for i in range(strip.numPixels()):
-            strip.setPixelColor(i, wheel((i + j) & 255))
-        strip.show()
-        time.sleep(wait_ms / 1000.0)
-
-def rainbow_effect(strip, stop_event):
-    while not stop_event.is_set():
-        rainbow_cycle(strip)
-
-def snake_effect(strip, stop_event):
-    snake_length = 15  # Initial length
-    position = 0  # Starting position
-    direction = 1  # 1 = forward, -1 = backward
-    food = random.randint(0, strip.numPixels() - 1)
-    while not stop_event.is_set():
-        # Clear strip
-        for i in range(strip.numPixels()):
-            strip.setPixelColor(i, Color(0, 0, 0))
-        
-        # Draw snake with random colors
-        for i in range(snake_length):
-            strip.setPixelColor(food, Color(255, 0, 0))  # Food is red
-            if 0 <= position - i * direction < strip.numPixels():
-                r = random.randint(0, 255)
-                g = random.randint(0, 255)
-                b = random.randint(0, 255)
-                strip.setPixelColor(position - i * direction, Color(r, g, b))
-            if position == food:
-                food = random.randint(0, strip.numPixels() - 1)
-                snake_length += 1  # Grow snake
-        if snake_length > strip.numPixels() // 2:
+RAINBOW_STEP_S = 0.02  # One palette entry per step
+
+def rainbow_effect(num_pixels):
+    palette = PALETTES['rainbow']
+    positions = np.arange(num_pixels)
+    def render(frame, t):
+        rotate_palette(frame, palette, positions, int(t / RAINBOW_STEP_S))
+    return render
+
+# Sprite layer: moving objects (snakes, comets, snowflakes) kept as arrays of
+# head position, velocity (LEDs per unit of time passed to move) and length,
+# plus a base color each. A draw erases the pixels the sprites covered last
+# time and paints the ones they cover now, so its cost follows the total
+# sprite length rather than the strip length. Sprites either bounce off the
+# strip ends or wrap around them; the body trails behind the head.
+class SpriteLayer:
+    def __init__(self, num_pixels, edges='bounce', colors=None):
+        self.num_pixels = num_pixels
+        self.edges = edges
+        self.colors = colors or solid_sprite_colors
+        self.position = np.zeros(0, dtype=np.float64)
+        self.velocity = np.zeros(0, dtype=np.float64)
+        self.length = np.zeros(0, dtype=np.intp)
+        self.color = np.zeros((0, 3), dtype=np.uint8)
+        self.drawn = None  # Pixel indices painted by the last draw
+
+    # Add one sprite, or several when position is an array (the other
+    # arguments are broadcast against it)
+    def add(self, position, velocity, length, color=(255, 255, 255)):
+        count = np.size(position)
+        self.position = np.append(self.position, position)
+        self.velocity = np.append(self.velocity, np.broadcast_to(velocity, count))
+        self.length = np.append(self.length, np.broadcast_to(length, count)).astype(np.intp)
+        self.color = np.concatenate([self.color, np.broadcast_to(np.asarray(color, dtype=np.uint8), (count, 3))])
+
+    # Advance every sprite by dt; returns a mask of sprites that bounced
+    def move(self, dt):
+        self.position += self.velocity * dt
+        n = self.num_pixels
+        if self.edges == 'wrap':
+            self.position %= n
+            return np.zeros(len(self.position), dtype=bool)
+        high = self.position > n - 1
+        low = self.position < 0
+        self.position[high] = 2 * (n - 1) - self.position[high]
+        self.position[low] = -self.position[low]
+        bounced = high | low
+        self.velocity[bounced] *= -1
+        np.clip(self.position, 0, n - 1, out=self.position)
+        return bounced
+
+    # Pixels covered by all sprites: (indices, sprite of each, offset from its head)
+    def cover(self):
+        ids = np.repeat(np.arange(len(self.length)), self.length)
+        offsets = np.arange(len(ids)) - np.repeat(np.cumsum(self.length) - self.length, self.length)
+        trail = np.where(self.velocity < 0, 1, -1)
+        index = np.floor(self.position).astype(np.intp)[ids] + offsets * trail[ids]
+        if self.edges == 'wrap':
+            return index % self.num_pixels, ids, offsets
+        inside = (index >= 0) & (index < self.num_pixels)
+        return index[inside], ids[inside], offsets[inside]
+
+    def draw(self, frame):
+        if self.drawn is not None:
+            frame[self.drawn] = 0
+        index, ids, offsets = self.cover()
+        frame[index] = self.colors(self, ids, offsets)
+        self.drawn = index
+
+    # Drop the record of painted pixels (after the frame was cleared elsewhere)
+    def forget(self):
+        self.drawn = None
+
+# Sprite color generators: (layer, sprite ids, offsets from head) -> (m, 3) colors
+def solid_sprite_colors(layer, ids, offsets):
+    return layer.color[ids]
+
+def random_sprite_colors(layer, ids, offsets):
+    return random_field((len(ids), 3), 0, 256, np.uint8)
+
+# Full brightness at the head fading linearly to the tail
+def comet_sprite_colors(layer, ids, offsets):
+    fade = (layer.length[ids] - offsets) * 256 // layer.length[ids]
+    return (layer.color[ids].astype(np.uint16) * fade[:, None].astype(np.uint16)) >> 8
+
+# Simultaneous snakes, comets and snowflakes
+SNAKE_COUNT = 1
+COMET_COUNT = 4
+SNOWFLAKE_COUNT = 40
+
+def snake_effect(num_pixels):
+    count = max(1, min(SNAKE_COUNT, num_pixels))
+    snakes = SpriteLayer(num_pixels, 'bounce', random_sprite_colors)
+    # Spread the snakes along the strip, alternating direction (1 LED per step)
+    snakes.add(np.arange(count) * num_pixels // count, np.where(np.arange(count) % 2, -1.0, 1.0), 15)
+    food = random_field(count, 0, num_pixels, np.intp)
+    steps_done = 0
+    clear = True  # Clear the whole strip on the next step: the first one, or after a burst
+
+    def render(frame, t):
+        nonlocal steps_done, clear
+        step = int(t / 0.1)  # Speed control
+        if step == steps_done:
+            return
+        steps_done = step
+
+        # Otherwise only the pixels the snakes covered are erased
+        if clear:
+            frame[:] = 0
+            snakes.forget()
+            clear = False
+
+        # Eat food and grow
+        eaten = np.floor(snakes.position).astype(np.intp) == food
+        if eaten.any():
+            food[eaten] = random_field(int(eaten.sum()), 0, num_pixels, np.intp)
+            snakes.length[eaten] += 1  # Grow snake
+
+        # Draw food, then the snakes over it with random colors
+        frame[food] = (255, 0, 0)  # Food is red
+        snakes.draw(frame)
+        too_long = snakes.length > num_pixels // 2
+        if too_long.any():
             #Burst
-            for i in range(strip.numPixels()):
-                strip.setPixelColor(i, Color(255, 255, 255))
-            snake_length = 15  # Reset length if too long
+            frame[:] = 255
+            snakes.length[too_long] = 15  # Reset length if too long
+            clear = True
 
-        
-        strip.show()
-        
         # Move and bounce
-        position += direction
-        if position >= strip.numPixels() or position < 0:
-            direction *= -1
-            position += direction * 2  # Adjust to bounce smoothly
-            snake_length = max(1, snake_length + random.choice([-1, 1]))  # Grow/shrink randomly
-        
-        time.sleep(0.1 / EFFECT_SPEED)  # Speed control
+        bounced = snakes.move(1)
+        if bounced.any():
+            change = noise_rng.choice([-1, 1], int(bounced.sum()))  # Grow/shrink randomly
+            snakes.length[bounced] = np.maximum(1, snakes.length[bounced] + change)
+    return render
+
+def comets_effect(num_pixels):
+    comets = SpriteLayer(num_pixels, 'wrap', comet_sprite_colors)
+    count = max(1, min(COMET_COUNT, num_pixels))
+    speed = uniform_field(count, 20.0, 60.0)  # LEDs per second
+    comets.add(uniform_field(count, 0, num_pixels), np.where(np.arange(count) % 2, -speed, speed),
+               min(12, num_pixels), PALETTES['rainbow'][random_field(count, 0, 256)])
+    last_t = None
+
+    def render(frame, t):
+        nonlocal last_t
+        if last_t is None:
+            frame[:] = 0
+        else:
+            comets.move(t - last_t)
+        last_t = t
+        comets.draw(frame)
+    return render
+
+def snow_effect(num_pixels):
+    flakes = SpriteLayer(num_pixels, 'wrap')
+    count = max(1, min(SNOWFLAKE_COUNT, num_pixels))
+    # Flakes drift toward the start of the strip at different speeds and brightness
+    brightness = random_field(count, 120, 256, np.uint8)
+    flakes.add(uniform_field(count, 0, num_pixels), -uniform_field(count, 2.0, 12.0), 1,
+               np.stack([brightness, brightness, brightness], axis=1))
+    last_t = None
+
+    def render(frame, t):
+        nonlocal last_t
+        if last_t is None:
+            frame[:] = 0
+        else:
+            flakes.move(t - last_t)
+        last_t = t
+        flakes.draw(frame)
+    return render
+
+# Random plague base color (reddish)
+def random_plague_color():
+    return np.array([noise_rng.integers(50, 256), noise_rng.integers(0, 101), noise_rng.integers(0, 101)], dtype=np.int16)
+
+# Plague outbreaks per cycle and LEDs each front advances per spread step
+# (live parameter 'plague.spread_rate')
+PLAGUE_SEEDS = 1
+PLAGUE_SPREAD_RATE = 1
+
+# Infection is tracked as contiguous [start, stop) intervals, one per
+# outbreak, whose two ends advance each step until they hit a strip end or
+# a neighbouring outbreak. A step only paints the LEDs its fronts just
+# reached, so its cost follows the number of fronts, not the strip length.
+def plague_spread_effect(num_pixels):
+    seeds = max(1, min(PLAGUE_SEEDS, num_pixels))
+    outbreaks = []  # [start, stop, color] sorted by start
+    next_spread = 0.0
+
+    def infect(frame, start, stop, color):
+        if stop > start:
+            variation = random_field((stop - start, 1), -20, 21)  # Color variations
+            frame[start:stop] = np.clip(color + variation, 0, 255)
+
+    def render(frame, t):
+        nonlocal outbreaks, next_spread
+        if t < next_spread:
+            return
+        next_spread += 0.2  # Spread speed
+
+        # New cycle: clear the strip and seed the outbreaks (the first in the middle)
+        if not outbreaks:
+            frame[:] = 0
+            if seeds == 1:
+                positions = [num_pixels // 2]
+            else:
+                positions = sorted(int(p) for p in noise_rng.choice(num_pixels, seeds, replace=False))
+            outbreaks = [[p, p + 1, random_plague_color()] for p in positions]
+            for start, stop, color in outbreaks:
+                infect(frame, start, stop, color)
+            return
+
+        # Spread: grow each interval up to the (already grown) one before it
+        # and the next one after it
+        rate = params.live.get('plague.spread_rate', PLAGUE_SPREAD_RATE)
+        limit = 0
+        for i, outbreak in enumerate(outbreaks):
+            start, stop, color = outbreak
+            upper = outbreaks[i + 1][0] if i + 1 < len(outbreaks) else num_pixels
+            new_start = max(start - rate, limit)
+            new_stop = min(stop + rate, upper)
+            infect(frame, new_start, start, color)
+            infect(frame, stop, new_stop, color)
+            outbreak[0] = new_start
+            outbreak[1] = new_stop
+            limit = new_stop
 
-def plague_spread_effect(strip, stop_event):
-    mid = strip.numPixels() // 2  # Start in middle
-    infected = [mid]  # Initial infected LED
-    base_color = Color(random.randint(50, 255), random.randint(0, 100), random.randint(0, 100))  # Random starting color
-    
-    while not stop_event.is_set():
-        # Light infected LEDs with color variations
-        for i in infected:
-            variation = random.randint(-20, 20)
-            r = max(0, min(255, (base_color >> 16) + variation))
-            g = max(0, min(255, ((base_color >> 8) & 0xFF) + variation))
-            b = max(0, min(255, (base_color & 0xFF) + variation))
-            strip.setPixelColor(i, Color(r, g, b))
-        strip.show()
-        
-        # Spread to neighbors
-        new_infected = set(infected)
-        for pos in infected:
-            if pos > 0 and pos - 1 not in infected:
-                new_infected.add(pos - 1)
-            if pos < strip.numPixels() - 1 and pos + 1 not in infected:
-                new_infected.add(pos + 1)
-        infected = list(new_infected)
-        
         # Reset if fully spread
-        if len(infected) == strip.numPixels():
-            time.sleep(1 / EFFECT_SPEED)  # Pause at full
-            infected = [mid]  # Reset to middle
-            base_color = Color(random.randint(50, 255), random.randint(0, 100), random.randint(0, 100))  # New color
-        
-        time.sleep(0.2 / EFFECT_SPEED)  # Spread speed
-        
-        # Clear uninfected
-        for i in range(strip.numPixels()):
-            if i not in infected:
-                strip.setPixelColor(i, Color(0, 0, 0))
-import colorsys  # Add this import at top if not present
-
-def random_multi_color_effect(strip, stop_event):
-    while not stop_event.is_set():
-        for i in range(strip.numPixels()):
-            # Generate random HSL for varied colors
-            h = random.random()  # Hue 0-1
-            s = random.uniform(0.5, 1.0)  # Saturation for vibrant colors
-            l = random.uniform(0.3, 0.7)  # Lightness for variety
-            r, g, b = [int(x * 255) for x in colorsys.hls_to_rgb(h, l, s)]
-            strip.setPixelColor(i, Color(r, g, b))
-        
-        strip.show()
-        time.sleep(1 / EFFECT_SPEED)  # Change rate
-
-def twinkling_starfield_effect(strip, stop_event):
-    intensities = [0] * strip.numPixels()  # Per-LED brightness
-    while not stop_event.is_set():
-        for i in range(strip.numPixels()):
-            # Randomly adjust intensity
-            intensities[i] += random.randint(-20, 20)
-            intensities[i] = max(0, min(255, intensities[i]))
-            # White-yellow tint
-            color = Color(intensities[i], intensities[i], random.randint(200, 255) if random.random() > 0.5 else intensities[i])
-            strip.setPixelColor(i, color)
-        
-        strip.show()
-        time.sleep(0.05 / EFFECT_SPEED)  # Fast twinkle
-
-def fire_flicker_effect(strip, stop_event):
-    # Base fire colors: reds, oranges, yellows
-    fire_colors = [
-        Color(255, 69, 0),   # OrangeRed
-        Color(255, 140, 0),  # DarkOrange
-        Color(255, 165, 0),  # Orange
-        Color(255, 215, 0),  # Gold
-        Color(255, 0, 0)     # Red
-    ]
-    intensities = [random.randint(50, 255) for _ in range(strip.numPixels())]  # Initial random intensities
-    
-    while not stop_event.is_set():
-        for i in range(strip.numPixels()):
-            # Flicker: random small changes
-            intensities[i] += random.randint(-30, 30)
-            intensities[i] = max(50, min(255, intensities[i]))  # Clamp for subtle flicker
-            
-            # Pick a base color and scale with intensity
-            base_color = random.choice(fire_colors)
-            r = (base_color >> 16) * intensities[i] // 255
-            g = ((base_color >> 8) & 0xFF) * intensities[i] // 255
-            b = (base_color & 0xFF) * intensities[i] // 255
-            strip.setPixelColor(i, Color(r, g, b))
-        
-        strip.show()
-        time.sleep(0.05 / EFFECT_SPEED)  # Fast flicker for realism
-
-def phase_out(strip, stop_event):
-    steps = 50
-    delay = 50 / EFFECT_SPEED  # Adjust for speed
-    for step in range(steps):
-        if stop_event.is_set():
+        if sum(stop - start for start, stop, _ in outbreaks) == num_pixels:
+            next_spread += 1  # Pause at full
+            outbreaks = []
+    return render
+
+# Vectorized colorsys.hls_to_rgb: arrays of h, l, s in 0-1 to an (n, 3) float array
+def hls_to_rgb(h, l, s):
+    m2 = np.where(l <= 0.5, l * (1.0 + s), l + s - l * s)
+    m1 = 2.0 * l - m2
+    def channel(hue):
+        hue = hue % 1.0
+        return np.select(
+            [hue < 1 / 6, hue < 0.5, hue < 2 / 3],
+            [m1 + (m2 - m1) * hue * 6.0, m2, m1 + (m2 - m1) * (2 / 3 - hue) * 6.0],
+            m1)
+    return np.stack([channel(h + 1 / 3), channel(h), channel(h - 1 / 3)], axis=-1)
+
+# Pure hues (HLS lightness 0.5, saturation 1) for 256 hue steps, centred on
+# zero: any HLS color is then l + (1 - |2l - 1|) * s * HUE_TABLE[hue]
+HUE_TABLE = hls_to_rgb(np.arange(256) / 256.0, np.full(256, 0.5), np.ones(256)).astype(np.float32) - 0.5
+
+def random_multi_color_effect(num_pixels):
+    steps_done = -1
+    def render(frame, t):
+        nonlocal steps_done
+        step = int(t)  # Change rate: once a second
+        if step == steps_done:
+            return
+        steps_done = step
+        # Random HLS fields for varied colors
+        hue = random_field(num_pixels, 0, 256)
+        s = uniform_field(num_pixels, 0.5, 1.0)  # Saturation for vibrant colors
+        l = uniform_field(num_pixels, 0.3, 0.7)  # Lightness for variety
+        chroma = (1.0 - np.abs(2.0 * l - 1.0)) * s
+        frame[:] = (l[:, None] + chroma[:, None] * HUE_TABLE[hue]) * 255
+    return render
+
+def twinkling_starfield_effect(num_pixels):
+    intensities = np.zeros(num_pixels, dtype=np.int16)  # Per-LED brightness
+    steps_done = -1
+    def render(frame, t):
+        nonlocal steps_done
+        step = int(t / 0.05)  # Fast twinkle
+        if step == steps_done:
+            return
+        steps_done = step
+        random_walk(intensities, 20, 0, 255)  # Randomly adjust intensity
+        # White-yellow tint
+        frame[:, 0] = intensities
+        frame[:, 1] = intensities
+        frame[:, 2] = np.where(uniform_field(num_pixels) > 0.5, random_field(num_pixels, 200, 256), intensities)
+    return render
+
+def fire_flicker_effect(num_pixels):
+    # Heat from smooth noise picks a color on the red -> gold half of the fire palette
+    palette = PALETTES['fire'][:len(PALETTES['fire']) // 2].astype(np.uint16)
+    positions = np.arange(num_pixels, dtype=np.float32) * 0.15
+    intensities = random_field(num_pixels, 50, 256)  # Initial random intensities
+    steps_done = -1
+
+    def render(frame, t):
+        nonlocal steps_done
+        step = int(t / 0.05)  # Fast flicker for realism
+        if step == steps_done:
+            return
+        steps_done = step
+        random_walk(intensities, 30, 50, 255)  # Flicker, clamped for subtle changes
+        heat = value_noise(positions, t * 2.0, octaves=2)
+        base_colors = palette[(heat * (len(palette) - 1)).astype(np.intp)]
+        frame[:] = base_colors * intensities[:, None].astype(np.uint16) // 255
+    return render
+
+def phase_out(num_pixels):
+    return transition_renderer('crossfade', (0, 0, 0), PHASE_OUT_S)  # Fade to black from the current frame
+
+MICHIGAN_FADE_STEPS = 20  # Number of fade frames; increase for slower fade
+MICHIGAN_FADE_STEP_S = 0.02  # Frame delay; adjust for smoothness
+MICHIGAN_HOLD_S = 1.0  # Pause duration; adjust as needed
+
+# One fade plus hold; evens and odds are back where they started after two
+def michigan_cycle_s():
+    return (MICHIGAN_FADE_STEPS + 1) * MICHIGAN_FADE_STEP_S + MICHIGAN_HOLD_S
+
+def michigan(num_pixels):
+    # Maize and Blue: palette runs maize (0) -> blue (128) -> maize
+    palette = PALETTES['maize_blue']
+    half = len(palette) // 2
+    alternate = (np.arange(num_pixels) % 2) * half  # Odds sit half a palette away from evens
+    cycle_s = michigan_cycle_s()
+
+    def render(frame, t):
+        iteration, u = divmod(t, cycle_s)
+        # Fade evens/odds across half the palette, then hold the pattern
+        step = min(MICHIGAN_FADE_STEPS, int(u / MICHIGAN_FADE_STEP_S))
+        offset = int(iteration) * half + round(step * half / MICHIGAN_FADE_STEPS)
+        rotate_palette(frame, palette, alternate, offset)
+    return render
+
+# Turn off all LEDs: wipe to black in place of whatever is playing, and wait for it
+def turn_off():
+    start_turn_off()
+    render_loop.wait_idle(TURN_OFF_S + 1.0)
+
+# Set from a turn-off wipe until the next effect starts: the wipe keeps the
+# loop active, but the lights are on their way out
+turning_off = False
+
+def start_turn_off():
+    global turning_off
+    turning_off = True
+    render_loop.play(transition_program('wipe', (0, 0, 0), TURN_OFF_S))
+
+# True while an effect (not the turn-off wipe) is playing
+def effect_playing():
+    return render_loop.active() and not turning_off
+
+# Wait for the wipe to finish without holding a thread; a later command
+# that starts the lights again cuts it short
+async def turn_off_done():
+    deadline = time.monotonic() + TURN_OFF_S + 1.0
+    while render_loop.active() and manual_off and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    if render_loop.active():
+        raise ValueError("Turn-off interrupted by a later command")
+    return "Lights turned off!"
+
+# Effect registry: name -> factory(num_pixels) returning render(frame, t)
+EFFECTS = {
+    'solid': solid_color,
+    'wipe': color_wipe_effect,
+    'chase': theater_chase_effect,
+    'rainbow': rainbow_effect,
+    'snake': snake_effect,
+    'plague': plague_spread_effect,
+    'random_multi': random_multi_color_effect,
+    'twinkle': twinkling_starfield_effect,
+    'fire_flicker': fire_flicker_effect,
+    'phase_out': phase_out,
+    'michigan': michigan,
+    'comets': comets_effect,
+    'snow': snow_effect,
+}
+
+# Deterministic effects: their frame depends only on the step index, so one
+# full period can be baked once and replayed. name -> (step_s, period_steps,
+# inputs) for a given pixel count, computed from the same constants the
+# effect uses; inputs are the other settings the frames depend on (colors,
+# palettes) and go into the cache key. Steps are in effect time, so
+# EFFECT_SPEED changes the playback rate but not the baked frames.
+BAKEABLE_EFFECTS = {
+    'rainbow': lambda num_pixels: (RAINBOW_STEP_S, len(PALETTES['rainbow']), PALETTES['rainbow'].tobytes()),
+    'chase': lambda num_pixels: (CHASE_STEP_S, 3 * CHASE_ITERATIONS * len(CHASE_COLORS), CHASE_COLORS),
+    'wipe': lambda num_pixels: (1.0 / EFFECT_FPS['wipe'], round(len(WIPE_COLORS) * WIPE_EFFECT_S * EFFECT_FPS['wipe']), WIPE_COLORS),
+    'michigan': lambda num_pixels: (MICHIGAN_FADE_STEP_S, round(2 * michigan_cycle_s() / MICHIGAN_FADE_STEP_S),
+                                    (MICHIGAN_FADE_STEPS, PALETTES['maize_blue'].tobytes())),
+}
+BAKE_VERSION = 1  # Bump when a bakeable effect's drawing code changes, so old spill files are not replayed
+
+# Bake cache: LRU of baked periods under a memory budget, optionally spilled
+# to memory-mapped .npy files so a restart replays without re-rendering
+BAKE_BUDGET_BYTES = 64 * 1024 * 1024
+BAKE_DIR = 'frame_cache'  # Relative to the working directory; None disables spilling
+BAKE_DISK_BUDGET_BYTES = 256 * 1024 * 1024  # Spill files past this are deleted, least recently used first
+bake_cache = collections.OrderedDict()  # key -> (frames, step_s)
+bake_cache_bytes = 0
+bake_lock = threading.Lock()
+
+def bake_key(effect_name, num_pixels):
+    step_s, period, inputs = BAKEABLE_EFFECTS[effect_name](num_pixels)
+    inputs_digest = hashlib.sha1(repr((BAKE_VERSION, inputs)).encode()).hexdigest()[:12]
+    return (effect_name, num_pixels, step_s, period, inputs_digest)
+
+# Keep BAKE_DIR within its budget. Files are marked used by their mtime;
+# old LED counts, palettes and BAKE_VERSIONs age out like anything else.
+# `keep` (the file just used) always stays.
+def prune_bake_dir(keep):
+    try:
+        files = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                       for entry in os.scandir(BAKE_DIR) if entry.name.endswith('.npy'))
+    except OSError:
+        return
+    total = sum(size for _, size, _ in files)
+    for _, size, path in files:
+        if total <= BAKE_DISK_BUDGET_BYTES:
             break
-        factor = (steps - step) / steps
-        for i in range(strip.numPixels()):
-            r = int(((strip.getPixelColor(i) >> 16) & 0xFF) * factor)
-            g = int(((strip.getPixelColor(i) >> 8) & 0xFF) * factor)
-            b = int((strip.getPixelColor(i) & 0xFF) * factor)
-            strip.setPixelColor(i, Color(r, g, b))
-        strip.show()
-        time.sleep(delay / 1000.0)
-def michigan(strip, stop_event):
-    # Maize and Blue colors
-    maize = Color(200, 255, 0)
-    blue = Color(7, 23, 242)
-    
-    # Precompute positions
-    evens = list(range(0, strip.numPixels(), 2))
-    odds = list(range(1, strip.numPixels(), 2))
-    
-    iteration = 0
-    while not stop_event.is_set():
-        # Determine current and target colors for evens/odds
-        if iteration % 2 == 0:
-            even_color_start = maize
-            odd_color_start = blue
-            even_color_target = blue
-            odd_color_target = maize
+        if path == keep:
+            continue
+        try:
+            os.remove(path)  # A mapping of it stays valid until released
+            total -= size
+        except OSError:
+            pass
+
+def bake_path(key):
+    digest = hashlib.sha1(repr(key).encode()).hexdigest()[:12]
+    return os.path.join(BAKE_DIR, f"{key[0]}-{key[1]}-{digest}.npy")
+
+# Render one period of an effect into a contiguous (period, n, 3) array,
+# sampling the middle of each step so float rounding never lands on an edge
+def bake_effect(effect_name, num_pixels, out=None):
+    step_s, period, _ = BAKEABLE_EFFECTS[effect_name](num_pixels)
+    frames = out if out is not None else np.zeros((period, num_pixels, 3), dtype=np.uint8)
+    render = EFFECTS[effect_name](num_pixels)
+    for k in range(period):
+        if k:
+            frames[k] = frames[k - 1]  # Effects may draw over the previous frame
+        render(frames[k], (k + 0.5) * step_s)
+    return frames
+
+# Baked frames for an effect, from memory, the spill file, or a fresh bake.
+# Returns None when one period would not fit in the budget.
+def get_baked_frames(effect_name, num_pixels):
+    global bake_cache_bytes
+    key = bake_key(effect_name, num_pixels)
+    step_s, period = key[2], key[3]
+    with bake_lock:
+        if key in bake_cache:
+            bake_cache.move_to_end(key)
+            return bake_cache[key][0]
+        size = period * num_pixels * 3
+        if size > BAKE_BUDGET_BYTES:
+            return None
+        frames = None
+        if BAKE_DIR:
+            path = bake_path(key)
+            try:
+                frames = np.load(path, mmap_mode='r')
+                if frames.shape != (period, num_pixels, 3):
+                    frames = None
+                else:
+                    os.utime(path)  # Mark it used
+            except (OSError, ValueError):
+                frames = None
+            if frames is None:
+                try:
+                    os.makedirs(BAKE_DIR, exist_ok=True)
+                    tmp_path = path + '.tmp'
+                    out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=(period, num_pixels, 3))
+                    bake_effect(effect_name, num_pixels, out)
+                    out.flush()
+                    del out
+                    os.replace(tmp_path, path)
+                    frames = np.load(path, mmap_mode='r')
+                except OSError as e:
+                    print(f"Frame cache spill failed: {e}")
+            prune_bake_dir(path)
+        if frames is None:
+            frames = bake_effect(effect_name, num_pixels)
+        while bake_cache and bake_cache_bytes + size > BAKE_BUDGET_BYTES:
+            _, (evicted, _) = bake_cache.popitem(last=False)
+            bake_cache_bytes -= evicted.nbytes
+        bake_cache[key] = (frames, step_s)
+        bake_cache_bytes += size
+        return frames
+
+# Renderer that replays a baked period by step index
+def baked_renderer(frames, step_s):
+    period = len(frames)
+    def render(frame, t):
+        frame[:] = frames[int(t / step_s) % period]
+    return render
+
+# Light sequences: precomputed shows stored on disk and streamed from a
+# memory map, so a long show never has to fit in RAM. Layout (little-endian):
+#   header  magic 'XLSQ', version, header size, led_count, fps, channel order,
+#           frame count, flags, offset of the frame index
+#   frames  one record per frame: type byte 0 = raw frame (led_count * 3 bytes)
+#           or 1 = delta against the previous frame: u16 span count, then per
+#           span u32 start pixel, u16 pixel count and the span's bytes
+#   index   u64 file offset of every frame record
+SEQUENCE_DIR = 'sequences'
+SEQUENCE_EXT = '.xlsq'
+SEQUENCE_MAGIC = b'XLSQ'
+SEQUENCE_HEADER = struct.Struct('<4sHHIf4sIIQ')
+SEQUENCE_FLAG_DELTA = 1
+SEQUENCE_SPAN = struct.Struct('<IH')
+
+# Changed spans between two frames, merging gaps of a few unchanged pixels
+def frame_spans(prev, frame, max_gap=4):
+    changed = np.flatnonzero(np.any(frame != prev, axis=1))
+    if len(changed) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(changed) > max_gap + 1)
+    starts = np.concatenate(([changed[0]], changed[breaks + 1]))
+    ends = np.concatenate((changed[breaks], [changed[-1]])) + 1
+    spans = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        spans.extend((a, min(end, a + 0xFFFF)) for a in range(start, end, 0xFFFF))  # Span length is a u16
+    return spans
+
+# Write frames ((led_count, 3) uint8 RGB arrays) to a sequence file. With
+# delta=True each frame is stored as changed spans when that is smaller,
+# with a raw keyframe at least every keyframe_interval frames.
+def write_sequence(path, frames, led_count, fps, channel_order='RGB', delta=True, keyframe_interval=40):
+    order = [channel_order.index(c) for c in 'RGB']
+    offsets = []
+    prev = None
+    with open(path, 'wb') as f:
+        f.write(b'\0' * SEQUENCE_HEADER.size)
+        for frame in frames:
+            frame = np.asarray(frame, dtype=np.uint8).reshape(led_count, 3)
+            stored = np.empty_like(frame)
+            stored[:, order] = frame  # RGB -> file channel order
+            index = len(offsets)
+            offsets.append(f.tell())
+            spans = frame_spans(prev, stored) if delta and index % keyframe_interval else None
+            if spans is not None and len(spans) <= 0xFFFF and sum(b - a for a, b in spans) * 3 + len(spans) * SEQUENCE_SPAN.size + 2 < led_count * 3:
+                f.write(b'\1' + struct.pack('<H', len(spans)))
+                for a, b in spans:
+                    f.write(SEQUENCE_SPAN.pack(a, b - a))
+                    f.write(stored[a:b].tobytes())
+            else:
+                f.write(b'\0' + stored.tobytes())
+            prev = stored
+        index_offset = f.tell()
+        f.write(np.asarray(offsets, dtype='<u8').tobytes())
+        f.seek(0)
+        f.write(SEQUENCE_HEADER.pack(SEQUENCE_MAGIC, 1, SEQUENCE_HEADER.size, led_count, fps,
+                                     channel_order.encode().ljust(4, b'\0'), len(offsets),
+                                     SEQUENCE_FLAG_DELTA if delta else 0, index_offset))
+
+# Memory-mapped sequence reader; decodes frames forward from the nearest keyframe
+class SequenceReader:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = self.offsets = None
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)  # ValueError if empty
+            if len(self.map) < SEQUENCE_HEADER.size:
+                raise ValueError(f"Not a light sequence: {path}")
+            (magic, version, header_size, self.led_count, self.fps, channel_order,
+             self.frame_count, self.flags, index_offset) = SEQUENCE_HEADER.unpack_from(self.map, 0)
+            if magic != SEQUENCE_MAGIC or version != 1 or self.frame_count == 0 or not self.fps > 0:
+                raise ValueError(f"Not a light sequence: {path}")
+            if index_offset + 8 * self.frame_count > len(self.map):
+                raise ValueError(f"Truncated light sequence: {path}")
+            self.channel_order = channel_order.rstrip(b'\0').decode()
+            self.offsets = np.frombuffer(self.map, dtype='<u8', count=self.frame_count, offset=index_offset)
+            if int(self.offsets.max()) >= len(self.map):
+                raise ValueError(f"Truncated light sequence: {path}")
+            self.order = [self.channel_order.index(c) for c in 'RGB']
+        except Exception:
+            self.close()
+            raise
+        self.current = np.zeros((self.led_count, 3), dtype=np.uint8)  # In file channel order
+        self.position = -1  # Index of the frame held in self.current
+
+    def apply(self, index):
+        offset = int(self.offsets[index])
+        if self.map[offset] == 0:
+            self.current[:] = np.frombuffer(self.map, dtype=np.uint8, count=self.led_count * 3, offset=offset + 1).reshape(-1, 3)
         else:
-            even_color_start = blue
-            odd_color_start = maize
-            even_color_target = maize
-            odd_color_target = blue
-        
-        # Fade transition over steps
-        fade_steps = 20  # Number of fade frames; increase for slower fade
-        for step in range(fade_steps + 1):
-            if stop_event.is_set(): return
-            
-            # Interpolation factor (0 to 1)
-            t = step / fade_steps
-            
-            # Lerp function for color components
-            def lerp(start, target, t):
-                return int(start + t * (target - start))
-            
-            # Compute interpolated colors
-            even_r = lerp((even_color_start >> 16) & 0xFF, (even_color_target >> 16) & 0xFF, t)
-            even_g = lerp((even_color_start >> 8) & 0xFF, (even_color_target >> 8) & 0xFF, t)
-            even_b = lerp(even_color_start & 0xFF, even_color_target & 0xFF, t)
-            odd_r = lerp((odd_color_start >> 16) & 0xFF, (odd_color_target >> 16) & 0xFF, t)
-            odd_g = lerp((odd_color_start >> 8) & 0xFF, (odd_color_target >> 8) & 0xFF, t)
-            odd_b = lerp(odd_color_start & 0xFF, odd_color_target & 0xFF, t)
-            
-            even_color = Color(even_r, even_g, even_b)
-            odd_color = Color(odd_r, odd_g, odd_b)
-            
-            # Set pixels
-            for pos in evens:
-                strip.setPixelColor(pos, even_color)
-            for pos in odds:
-                strip.setPixelColor(pos, odd_color)
-            
-            strip.show()
-            time.sleep(0.02 / EFFECT_SPEED)  # Frame delay; adjust for smoothness
-        
-        # Hold the pattern for a bit before next fade
-        time.sleep(1.0 / EFFECT_SPEED)  # Pause duration; adjust as needed
-        
-        iteration += 1
-# Turn off all LEDs
-def turn_off(strip):
-    color_wipe(strip, Color(0, 0, 0), 10)
+            (spans,) = struct.unpack_from('<H', self.map, offset + 1)
+            offset += 3
+            for _ in range(spans):
+                start, count = SEQUENCE_SPAN.unpack_from(self.map, offset)
+                offset += SEQUENCE_SPAN.size
+                self.current[start:start + count] = np.frombuffer(self.map, dtype=np.uint8, count=count * 3, offset=offset).reshape(-1, 3)
+                offset += count * 3
+        self.position = index
+
+    # Decode frame `index` into out (RGB, cropped or padded to len(out))
+    def read(self, index, out):
+        if index != self.position:
+            if index < self.position or self.position < 0:
+                start = index
+                while self.map[int(self.offsets[start])] != 0:
+                    start -= 1  # Back up to the keyframe
+            else:
+                start = self.position + 1
+            for i in range(start, index + 1):
+                self.apply(i)
+        n = min(len(out), self.led_count)
+        out[:n] = self.current[:n, self.order]
+        out[n:] = 0
+
+    def close(self):
+        self.offsets = None  # Release the view into the map before closing it
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+def sequence_path(name):
+    return os.path.join(SEQUENCE_DIR, name + SEQUENCE_EXT)
 
-# Select the effect function based on name
+# Effect: play a sequence file on a loop at its own frame rate
+def sequence_effect(name):
+    def factory(num_pixels):
+        reader = SequenceReader(sequence_path(name))
+        def render(frame, t):
+            reader.read(int(t * reader.fps) % reader.frame_count, frame)
+        return render
+    return factory
+
+# Select the effect program based on name (see RenderLoop)
 def get_effect_function(effect_name):
-    if effect_name == 'solid':
-        return solid_color
-    elif effect_name == 'wipe':
-        return color_wipe_effect
-    elif effect_name == 'chase':
-        return theater_chase_effect
-    elif effect_name == 'rainbow':
-        return rainbow_effect
-    elif effect_name == 'snake':
-        return snake_effect
-    elif effect_name == 'plague':
-        return plague_spread_effect
-    elif effect_name == 'random_multi':
-        return random_multi_color_effect
-    elif effect_name == 'twinkle':
-        return twinkling_starfield_effect
-    elif effect_name == 'fire_flicker':
-        return fire_flicker_effect
-    elif effect_name == 'phase_out':
-        return phase_out
-    elif effect_name == 'michigan':
-        return michigan
-    else:
+    if effect_name.startswith('sequence:'):
+        return get_sequence_function(effect_name[len('sequence:'):])
+    if effect_name == 'zones':
+        return get_zones_function()
+    if effect_name == 'layers':
+        return get_layers_function()
+    if effect_name not in EFFECTS:
         raise ValueError("Unknown effect: " + effect_name)
 
-# Stop current effect if running
+    def program(num_pixels):
+        return effect_renderer(effect_name, num_pixels), EFFECT_FPS.get(effect_name, DEFAULT_FPS)
+    program.spec = ('effect', effect_name)
+    return program
+
+# Renderer for a registered effect on num_pixels LEDs: replays baked frames
+# when the effect has them, otherwise calls the factory (with any parameters)
+def effect_renderer(effect_name, num_pixels, params=None):
+    if not params and effect_name in BAKEABLE_EFFECTS:
+        frames = get_baked_frames(effect_name, num_pixels)
+        if frames is not None:
+            return baked_renderer(frames, BAKEABLE_EFFECTS[effect_name](num_pixels)[0])
+    return EFFECTS[effect_name](num_pixels, **(params or {}))
+
+# Program for a sequence file in SEQUENCE_DIR, run at the file's FPS
+def get_sequence_function(name):
+    if not re.fullmatch(r'[\w-]+', name):
+        raise ValueError("Invalid sequence name: " + name)
+    path = sequence_path(name)
+    reader = SequenceReader(path)  # Validates the header; raises OSError/ValueError
+    fps = reader.fps
+    reader.close()
+    factory = sequence_effect(name)
+
+    def program(num_pixels):
+        return factory(num_pixels), fps
+    program.spec = ('effect', 'sequence:' + name)
+    return program
+
+# Zones: named [start, stop) pixel ranges of the strip, each running its own
+# effect at its own speed, with optional factory parameters (e.g. a color
+# for solid). One frame clock renders every zone into its slice of the shared
+# framebuffer and shows the whole strip once per frame. Pixels outside every
+# zone stay dark. Selected as the pseudo-effect 'zones'.
+ZONES = []
+SEGMENT_SPEED_MAX = 10.0  # Fastest zone or layer speed (a multiple of effect time)
+
+# Check a zone against the strip and the other zones; returns an error or None
+def zone_error(zone, zones):
+    if not re.fullmatch(r'[\w-]+', zone['name']):
+        return "Invalid zone name!"
+    if not 0 <= zone['start'] < zone['stop'] <= LED_COUNT:
+        return f"Zone must satisfy 0 <= start < stop <= {LED_COUNT}!"
+    if zone['effect'] not in EFFECTS:
+        return "Invalid effect!"
+    if not 0 < zone['speed'] <= SEGMENT_SPEED_MAX:  # Also refuses inf and nan
+        return f"Speed must be above 0 and at most {SEGMENT_SPEED_MAX}!"
+    for other in zones:
+        if other['name'] != zone['name'] and zone['start'] < other['stop'] and other['start'] < zone['stop']:
+            return f"Zone overlaps zone {other['name']}!"
+    try:
+        EFFECTS[zone['effect']](zone['stop'] - zone['start'], **zone['params'])
+    except (TypeError, ValueError):
+        return "Invalid parameters for this effect!"
+    return None
+
+# Render every zone into its slice of the frame
+def zones_renderer(zones, num_pixels):
+    parts = []
+    for zone in zones:
+        stop = min(zone['stop'], num_pixels)
+        if zone['start'] < stop:
+            parts.append((zone['start'], stop, zone['speed'], effect_renderer(zone['effect'], stop - zone['start'], zone['params'])))
+    first = True
+    def render(frame, t):
+        nonlocal first
+        if first:
+            frame[:] = 0
+            first = False
+        for start, stop, speed, zone_render in parts:
+            zone_render(frame[start:stop], t * speed)  # A finished zone keeps its last frame
+    return render
+
+def get_zones_function(zones=None):
+    zones = [dict(zone) for zone in (ZONES if zones is None else zones)]
+    if not zones:
+        raise ValueError("No zones configured")
+    fps = max(EFFECT_FPS.get(zone['effect'], DEFAULT_FPS) for zone in zones)  # Fastest zone sets the pace
+
+    def program(num_pixels):
+        return zones_renderer(zones, num_pixels), fps
+    program.spec = ('zones', zones)
+    return program
+
+# Layers: a stack of effects over the whole strip, bottom first. Each layer
+# renders into its own buffer and is blended onto the ones below it with its
+# blend mode and opacity. Selected as the pseudo-effect 'layers'.
+LAYERS = []
+
+# Blend modes: merge a layer (float32, 0-255) into the float32 accumulator
+# in place, weighted by the layer's opacity (0-1). scratch is a float32
+# buffer the size of the layer and coverage an (n, 1) one, so a blend
+# allocates nothing per frame.
+def blend_normal(acc, layer, opacity, scratch, coverage):
+    np.subtract(layer, acc, out=scratch)
+    scratch *= opacity
+    acc += scratch
+
+# Black is transparent: each pixel's brightest channel sets its coverage
+def blend_alpha(acc, layer, opacity, scratch, coverage):
+    column = coverage[:, 0]
+    np.maximum(layer[:, 0], layer[:, 1], out=column)
+    np.maximum(column, layer[:, 2], out=column)
+    column *= opacity / 255.0
+    np.subtract(layer, acc, out=scratch)
+    scratch *= coverage
+    acc += scratch
+
+def blend_add(acc, layer, opacity, scratch, coverage):
+    np.multiply(layer, opacity, out=scratch)
+    acc += scratch
+    np.minimum(acc, 255.0, out=acc)
+
+def blend_screen(acc, layer, opacity, scratch, coverage):
+    np.subtract(255.0, acc, out=scratch)
+    scratch *= layer
+    scratch *= opacity / 255.0
+    acc += scratch
+
+def blend_multiply(acc, layer, opacity, scratch, coverage):
+    np.multiply(layer, opacity / 255.0, out=scratch)
+    scratch += 1.0 - opacity
+    acc *= scratch
+
+def blend_max(acc, layer, opacity, scratch, coverage):
+    np.multiply(layer, opacity, out=scratch)
+    np.maximum(acc, scratch, out=acc)
+
+BLEND_MODES = {
+    'normal': blend_normal,
+    'alpha': blend_alpha,
+    'add': blend_add,
+    'screen': blend_screen,
+    'multiply': blend_multiply,
+    'max': blend_max,
+}
+
+# Check a layer's settings; returns an error or None
+def layer_error(layer):
+    if not re.fullmatch(r'[\w-]+', layer['name']):
+        return "Invalid layer name!"
+    if layer['effect'] not in EFFECTS:
+        return "Invalid effect!"
+    if layer['blend'] not in BLEND_MODES:
+        return "Invalid blend mode (" + ', '.join(BLEND_MODES) + ")!"
+    if not 0.0 <= layer['opacity'] <= 1.0:
+        return "Opacity must be between 0 and 1!"
+    if not 0 < layer['speed'] <= SEGMENT_SPEED_MAX:  # Also refuses inf and nan
+        return f"Speed must be above 0 and at most {SEGMENT_SPEED_MAX}!"
+    try:
+        EFFECTS[layer['effect']](LED_COUNT, **layer['params'])
+    except (TypeError, ValueError):
+        return "Invalid parameters for this effect!"
+    return None
+
+# Render every layer into its own buffer and blend them bottom-up into the frame
+def layers_renderer(layers, num_pixels):
+    parts = [(new_framebuffer(num_pixels), np.zeros((num_pixels, 3), dtype=np.float32), BLEND_MODES[layer['blend']],
+              layer['opacity'], layer['speed'], effect_renderer(layer['effect'], num_pixels, layer['params'])) for layer in layers]
+    acc = np.zeros((num_pixels, 3), dtype=np.float32)
+    scratch = np.zeros((num_pixels, 3), dtype=np.float32)
+    coverage = np.zeros((num_pixels, 1), dtype=np.float32)
+    def render(frame, t):
+        acc[:] = 0
+        for buffer, layer, blend, opacity, speed, layer_render in parts:
+            layer_render(buffer, t * speed)  # A finished layer keeps its last frame
+            np.copyto(layer, buffer)
+            blend(acc, layer, opacity, scratch, coverage)
+        np.copyto(frame, acc, casting='unsafe')
+    return render
+
+def get_layers_function(layers=None):
+    layers = [dict(layer) for layer in (LAYERS if layers is None else layers)]
+    if not layers:
+        raise ValueError("No layers configured")
+    fps = max(EFFECT_FPS.get(layer['effect'], DEFAULT_FPS) for layer in layers)  # Fastest layer sets the pace
+
+    def program(num_pixels):
+        return layers_renderer(layers, num_pixels), fps
+    program.spec = ('layers', layers)
+    return program
+
+# Crossfade between effects on a switch (seconds; 0 swaps on the next frame)
+EFFECT_CROSSFADE_S = 0.0
+
+# Longest wait for the render loop to stop; a stuck loop must not hang the command queue
+STOP_TIMEOUT_S = 2.0
+
+# Stop current effect if running; the last frame stays on the strip
 def stop_current_effect():
-    global current_effect_thread
-    if current_effect_thread and current_effect_thread.is_alive():
-        stop_event.set()
-        current_effect_thread.join()
-
-# Start effect
-def start_effect():
-    global current_effect_thread, current_effect_func
-    stop_event.clear()
-    current_effect_thread = threading.Thread(target=current_effect_func, args=(strip, stop_event))
-    current_effect_thread.start()
+    if render_loop.active():
+        render_loop.stop(STOP_TIMEOUT_S)
+
+# Start the selected effect, replacing whatever is playing at the next frame
+def start_effect(crossfade=None):
+    global turning_off
+    turning_off = False
+    render_loop.play(current_effect_func, EFFECT_CROSSFADE_S if crossfade is None else crossfade)
 
 # Helper to check if in scheduled time window
 def is_in_time_window():
@@ -485,348 +2261,693 @@ def broadcast_state():
         'custom_solid_r': CUSTOM_SOLID_COLOR[0],
         'custom_solid_g': CUSTOM_SOLID_COLOR[1],
         'custom_solid_b': CUSTOM_SOLID_COLOR[2],
-        'effect_speed': EFFECT_SPEED
+        'effect_speed': EFFECT_SPEED,
+        'zones': ZONES,
+        'layers': LAYERS,
+        'gamma': GAMMA,
+        'white_balance': list(WHITE_BALANCE),
+        'channel_order': CHANNEL_ORDER
     }
-    socketio.emit('update_state', state)
+    state_sync.publish(state)
+
+# State sync: every field of the broadcast state carries the version it
+# last changed in, and each dashboard gets only the fields changed since
+# the version it has acknowledged. A client gets at most one update every
+# STATE_SYNC_INTERVAL_S and has at most one in flight, so a burst (a
+# brightness slider drag) reaches it as a single delta with the latest
+# values. A client that leaves an update unacknowledged for
+# STATE_SYNC_RESYNC_S is behind: its next update is a full snapshot. One
+# silent for STATE_SYNC_DROP_S is disconnected. Connecting, or
+# reconnecting, gets exactly one snapshot.
+#   server -> client  'state_snapshot' {version, state}
+#                     'state_delta'    {version, base, changes}
+#   client -> server  'state_ack'      {version}
+#                     'state_resync'   (its version does not match a delta's base)
+STATE_SYNC_INTERVAL_S = 0.1
+STATE_SYNC_RESYNC_S = 2.0
+STATE_SYNC_DROP_S = 10.0
+
+state_sync_stats = {'deltas': 0, 'snapshots': 0, 'resyncs': 0, 'drops': 0}
+
+class StateSync:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.version = 0
+        self.state = {}
+        self.changed = {}  # Field -> version it last changed in
+        self.clients = {}  # sid -> {'sent', 'acked', 'sent_at', 'behind'}
+        self.thread = None
+
+    # Record a new state; only fields that differ get a new version
+    def publish(self, state):
+        with self.lock:
+            changes = [field for field, value in state.items() if field not in self.state or self.state[field] != value]
+            if not changes:
+                return
+            self.version += 1
+            for field in changes:
+                self.state[field] = state[field]
+                self.changed[field] = self.version
+        self.wake.set()
+
+    def connect(self, sid):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.clients[sid] = {'sent': self.version, 'acked': None, 'sent_at': time.monotonic(), 'behind': False}
+            snapshot = {'version': self.version, 'state': dict(self.state)}
+            state_sync_stats['snapshots'] += 1
+        socketio.emit('state_snapshot', snapshot, to=sid)
+
+    def disconnect(self, sid):
+        with self.lock:
+            self.clients.pop(sid, None)
+
+    def ack(self, sid, version):
+        with self.lock:
+            client = self.clients.get(sid)
+            if client is not None and version == client['sent']:
+                client['acked'] = version
+        self.wake.set()
+
+    # The client lost track: send it a snapshot next
+    def resync(self, sid):
+        with self.lock:
+            client = self.clients.get(sid)
+            if client is not None:
+                client['behind'] = True
+                client['acked'] = client['sent']
+        self.wake.set()
+
+    def run(self):
+        while True:
+            self.wake.wait(STATE_SYNC_INTERVAL_S)
+            self.wake.clear()
+            now = time.monotonic()
+            sends = []
+            drops = []
+            with self.lock:
+                for sid, client in self.clients.items():
+                    if client['acked'] != client['sent']:  # Update in flight
+                        waited = now - client['sent_at']
+                        if waited > STATE_SYNC_DROP_S:
+                            drops.append(sid)
+                        elif waited > STATE_SYNC_RESYNC_S:
+                            client['behind'] = True
+                        continue
+                    if (client['sent'] == self.version and not client['behind']) or now - client['sent_at'] < STATE_SYNC_INTERVAL_S:
+                        continue
+                    if client['behind']:
+                        sends.append((sid, 'state_snapshot', {'version': self.version, 'state': dict(self.state)}))
+                        state_sync_stats['resyncs'] += 1
+                        client['behind'] = False
+                    else:
+                        changes = {field: self.state[field] for field, version in self.changed.items() if version > client['acked']}
+                        sends.append((sid, 'state_delta', {'version': self.version, 'base': client['acked'], 'changes': changes}))
+                        state_sync_stats['deltas'] += 1
+                    client['sent'] = self.version
+                    client['sent_at'] = now
+                for sid in drops:
+                    del self.clients[sid]
+                    state_sync_stats['drops'] += 1
+            for sid, event, payload in sends:
+                socketio.emit(event, payload, to=sid)
+            for sid in drops:
+                socketio.server.disconnect(sid)
+
+state_sync = StateSync()
+
+# Live preview: a sampler thread copies the frame on the strip
+# (render_loop.copy_frame(), shared memory with a render process) at up
+# to PREVIEW_FPS while anyone is watching, averages it down to at most
+# PREVIEW_MAX_PIXELS and encodes it once for all viewers as a binary
+# 'preview' message. The render loop never waits on it: the cost is one
+# copy and a few array passes per preview frame, recorded as
+# preview_seconds. Message layout (little-endian):
+#   uint8 encoding, uint8 0, uint16 pixel count, uint32 frame sequence, then
+#   PREVIEW_RAW:   count * RGB
+#   PREVIEW_RLE:   runs of (uint16 length, RGB)
+#   PREVIEW_DELTA: uint16 span count, (uint16 start, uint16 length) per span,
+#                  then the RGB of every changed pixel; applies to frame sequence - 1
+# The sequence only advances when the frame changes. Each frame goes out
+# as the smallest encoding the viewer can apply; a viewer gets a delta only
+# if it has the previous frame. Viewers acknowledge frames ('preview_ack'
+# {seq}) and one with PREVIEW_WINDOW frames unacknowledged is skipped until
+# it catches up, so a slow phone only lowers its own frame rate.
+PREVIEW_FPS = 15
+PREVIEW_MAX_FPS = 20
+PREVIEW_MAX_PIXELS = 300
+PREVIEW_PIXEL_LIMIT = 0xFFFF  # The header's pixel count is 16 bits
+PREVIEW_WINDOW = 2
+PREVIEW_RAW, PREVIEW_RLE, PREVIEW_DELTA = 0, 1, 2
+
+preview_stats = {'frames': 0, 'bytes': 0, 'skipped': 0}
+
+# Average an (n, 3) frame down to at most `limit` pixels
+def downsample_frame(frame, limit):
+    if len(frame) <= limit:
+        return frame
+    starts = np.linspace(0, len(frame), limit, endpoint=False).astype(np.intp)
+    sums = np.add.reduceat(frame.astype(np.uint32), starts, axis=0)
+    sizes = np.diff(np.append(starts, len(frame)))[:, None]
+    return (sums // sizes).astype(np.uint8)
+
+def preview_header(encoding, count, seq):
+    return struct.pack('<BBHI', encoding, 0, count, seq)
+
+def encode_preview_rle(frame, packed):
+    starts = np.flatnonzero(np.diff(packed, prepend=-1))
+    runs = np.empty(len(starts), dtype=[('length', '<u2'), ('rgb', 'u1', 3)])
+    runs['length'] = np.diff(np.append(starts, len(packed)))
+    runs['rgb'] = frame[starts]
+    return runs.tobytes()
+
+def encode_preview_delta(frame, packed, previous):
+    changed = packed != previous
+    edges = np.flatnonzero(np.diff(changed.astype(np.int8), prepend=0, append=0))
+    spans = edges.reshape(-1, 2).astype('<u2')
+    spans[:, 1] -= spans[:, 0]  # (start, stop) -> (start, length)
+    return struct.pack('<H', len(spans)) + spans.tobytes() + frame[changed].tobytes()
+
+class PreviewStream:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.clients = {}  # sid -> {'interval', 'seq', 'sent_at', 'unacked'}
+        self.thread = None
+        self.seq = 0
+        self.packed = None  # Last preview frame (downsampled), packed to 24-bit for comparisons
+        self.key = None     # Its message as a keyframe
+        self.delta = None   # ... and as a delta, when smaller
+
+    def subscribe(self, sid, fps=None):
+        fps = min(max(float(fps or PREVIEW_FPS), 1.0), PREVIEW_MAX_FPS)
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.clients[sid] = {'interval': 1.0 / fps, 'seq': None, 'sent_at': 0.0, 'unacked': []}
+        self.wake.set()
+
+    def unsubscribe(self, sid):
+        with self.lock:
+            self.clients.pop(sid, None)
+
+    def ack(self, sid, seq):
+        with self.lock:
+            client = self.clients.get(sid)
+            if client is not None and seq in client['unacked']:
+                del client['unacked'][:client['unacked'].index(seq) + 1]
+
+    # Copy the current frame and, if it changed, encode it as the next
+    # preview frame
+    def sample(self):
+        current = render_loop.copy_frame()
+        if current is None:
+            return
+        frame = downsample_frame(current, PREVIEW_MAX_PIXELS)
+        packed = pack_frame(frame)
+        previous = self.packed if self.packed is not None and len(self.packed) == len(packed) else None
+        if previous is not None and np.array_equal(packed, previous):
+            return
+        self.seq += 1
+        self.packed = packed
+        raw = frame.tobytes()
+        rle = encode_preview_rle(frame, packed)
+        if len(rle) < len(raw):
+            self.key = preview_header(PREVIEW_RLE, len(frame), self.seq) + rle
+        else:
+            self.key = preview_header(PREVIEW_RAW, len(frame), self.seq) + raw
+        self.delta = None
+        if previous is not None:
+            delta = preview_header(PREVIEW_DELTA, len(frame), self.seq) + encode_preview_delta(frame, packed, previous)
+            if len(delta) < len(self.key):
+                self.delta = delta
+
+    def run(self):
+        while True:
+            with self.lock:
+                watching = bool(self.clients)
+                interval = min((c['interval'] for c in self.clients.values()), default=1.0 / PREVIEW_FPS)
+            if not watching:
+                self.wake.wait()
+                self.wake.clear()
+                continue
+            started = time.monotonic()
+            self.sample()
+            metrics['preview_seconds'].observe(time.monotonic() - started)
+            sends = []
+            now = time.monotonic()
+            with self.lock:
+                for sid, client in self.clients.items():
+                    if self.key is None or client['seq'] == self.seq or now - client['sent_at'] < client['interval'] * 0.9:
+                        continue  # Nothing new for it, or not due yet
+                    if len(client['unacked']) >= PREVIEW_WINDOW:
+                        preview_stats['skipped'] += 1
+                        continue
+                    message = self.delta if self.delta is not None and client['seq'] == self.seq - 1 else self.key
+                    client['seq'] = self.seq
+                    client['sent_at'] = now
+                    client['unacked'].append(self.seq)
+                    sends.append((sid, message))
+                    preview_stats['frames'] += 1
+                    preview_stats['bytes'] += len(message)
+            for sid, message in sends:
+                socketio.emit('preview', message, to=sid)
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+preview = PreviewStream()
+
+# Control commands: routes check their arguments, queue the work and
+# return 202 with a command id straight away, so no request handler waits
+# on the strip, a wipe, a bake or bluetoothctl. One asyncio loop on its
+# own thread runs commands one at a time in the order they arrived, and
+# tells every dashboard when each finishes with a 'command_done' event
+# ({command, name, ok, message or error, queued_ms, run_ms}). Work is a
+# coroutine function or a plain function (run in a worker thread); it
+# returns the completion message, or raises ValueError to fail the command.
+# Work that has to wait for something slow that needs no more ordering
+# (a wipe finishing) returns a coroutine for it instead; the next command
+# starts while it runs, and it supplies the message when it finishes.
+class CommandQueue:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.loop = None
+        self.queue = None
+        self.thread = None
+
+    def submit(self, name, work):
+        with self.lock:
+            if self.thread is None:
+                ready = threading.Event()
+                self.thread = threading.Thread(target=self.run, args=(ready,), daemon=True)
+                self.thread.start()
+                ready.wait()
+            command_id = next(self.ids)
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (command_id, name, work, time.monotonic()))
+        return command_id
+
+    def run(self, ready):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.queue = asyncio.Queue()
+        ready.set()
+        self.loop.run_until_complete(self.serve())
+
+    async def serve(self):
+        tasks = set()  # Finishing commands; the loop only keeps weak references
+        while True:
+            command_id, name, work, queued = await self.queue.get()
+            started = time.monotonic()
+            if asyncio.iscoroutinefunction(work):
+                outcome = work()
+            else:
+                outcome = asyncio.to_thread(work)
+            message = await self.finish(command_id, name, outcome, queued, started)
+            if asyncio.iscoroutine(message):
+                task = asyncio.create_task(self.finish(command_id, name, message, queued, started))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+    # Await a command's outcome and report it, unless it hands back a
+    # coroutine to finish later
+    async def finish(self, command_id, name, outcome, queued, started):
+        try:
+            message = await outcome
+            if asyncio.iscoroutine(message):
+                return message
+            result = {'ok': True, 'message': message}
+        except ValueError as e:
+            result = {'ok': False, 'error': str(e)}
+        except Exception as e:
+            print(f"Command {name} failed: {e}")
+            result = {'ok': False, 'error': f"{name} failed: {e}"}
+        done = time.monotonic()
+        histogram = command_metrics.get(name)
+        if histogram is None:
+            histogram = command_metrics.setdefault(name, RollingHistogram())
+        histogram.observe(done - queued)
+        socketio.emit('command_done', dict(result, command=command_id, name=name,
+                                           queued_ms=round((started - queued) * 1000, 3),
+                                           run_ms=round((done - started) * 1000, 3)))
+
+commands = CommandQueue()
+
+# Queue a control command and answer the request with its id
+def queue_command(name, work):
+    command_id = commands.submit(name, work)
+    return jsonify({"message": f"{name} queued", "command": command_id}), 202
 
 # SocketIO events
 @socketio.on('connect')
 def handle_connect():
-    broadcast_state()  # Send current state on connect
+    broadcast_state()  # Bring the synced state up to date, then snapshot it for this client
+    state_sync.connect(request.sid)
+
+@socketio.on('disconnect')
+def handle_disconnect(*args):
+    state_sync.disconnect(request.sid)
+    preview.unsubscribe(request.sid)
+
+@socketio.on('preview_subscribe')
+def handle_preview_subscribe(message=None):
+    preview.subscribe(request.sid, (message or {}).get('fps'))
+
+@socketio.on('preview_unsubscribe')
+def handle_preview_unsubscribe(*args):
+    preview.unsubscribe(request.sid)
+
+@socketio.on('preview_ack')
+def handle_preview_ack(message):
+    preview.ack(request.sid, message.get('seq'))
+
+@socketio.on('state_ack')
+def handle_state_ack(message):
+    state_sync.ack(request.sid, message.get('version'))
+
+@socketio.on('state_resync')
+def handle_state_resync(*args):
+    state_sync.resync(request.sid)
 
 # Web endpoints
+# Dashboard assets: the files in static/ are read and compressed once at
+# startup and served from memory with strong ETags. The page references
+# each asset with its content hash (?v=...), so assets can be cached for a
+# year; the page itself is revalidated on every load, which costs a 304.
+# All dynamic state arrives over Socket.IO ('state_snapshot' on connect,
+# then 'state_delta'). The Socket.IO client is the official one (MIT),
+# vendored so the page works without internet access; it uses WebSocket
+# when the simple-websocket package is installed and long-polling otherwise.
+ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')  # Ships with the script
+ASSET_MAX_AGE = 365 * 24 * 3600
+ASSETS = {}  # name -> {'type', 'etag', 'identity', 'gzip', 'br'}
+
+def compile_asset(body, content_type):
+    asset = {'type': content_type, 'etag': hashlib.sha256(body).hexdigest()[:20], 'identity': body}
+    compressed = {'gzip': gzip.compress(body, 9, mtime=0)}
+    if brotli is not None:
+        compressed['br'] = brotli.compress(body, quality=11)
+    for encoding, data in compressed.items():
+        if len(data) < len(body):
+            asset[encoding] = data
+    return asset
+
+def build_assets():
+    assets = {}
+    for name in sorted(os.listdir(ASSET_DIR)):
+        if name != 'index.html':
+            with open(os.path.join(ASSET_DIR, name), 'rb') as f:
+                assets[name] = compile_asset(f.read(), mimetypes.guess_type(name)[0] or 'application/octet-stream')
+    with open(os.path.join(ASSET_DIR, 'index.html'), encoding='utf-8') as f:
+        page = f.read()
+    page = re.sub(r'(href|src)="/static/([^"?]+)"',
+                  lambda m: f'{m.group(1)}="/static/{m.group(2)}?v={assets[m.group(2)]["etag"]}"', page)
+    assets['index.html'] = compile_asset(page.encode('utf-8'), 'text/html; charset=utf-8')
+    ASSETS.clear()
+    ASSETS.update(assets)
+
+# Serve a compiled asset in the best encoding the client accepts, or 304
+# when it already has it
+def serve_asset(name, cache_control):
+    asset = ASSETS.get(name)
+    if asset is None:
+        return jsonify({"error": "Not found!"}), 404
+    encoding = 'identity'
+    for candidate in ('br', 'gzip'):
+        if candidate in asset and request.accept_encodings[candidate]:
+            encoding = candidate
+            break
+    etag = asset['etag'] if encoding == 'identity' else f"{asset['etag']}-{encoding}"
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+    if request.if_none_match.contains(etag):
+        return app.response_class(status=304, headers=headers)
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    return app.response_class(asset[encoding], status=200, headers=headers, content_type=asset['type'])
+
+build_assets()
+
 @app.route('/')
 @auth.login_required
 def index():
-    # Polished HTML dashboard with CSS and JS for real-time and AJAX
-    html = """
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <title>LED Control Dashboard</title>
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <script src="https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.5.4/socket.io.js"></script>
-        <style>
-            body {
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                background-color: #f0f4f8;
-                color: #333;
-                margin: 0;
-                padding: 20px;
-                display: flex;
-                justify-content: center;
-                align-items: center;
-                min-height: 100vh;
-            }
-            .container {
-                background: white;
-                border-radius: 12px;
-                box-shadow: 0 4px 20px rgba(0, 0, 0, 0.1);
-                padding: 30px;
-                max-width: 500px;
-                width: 100%;
-            }
-            h1 {
-                text-align: center;
-                color: #2c3e50;
-                margin-bottom: 20px;
-            }
-            .status {
-                background: #e8f4fd;
-                border-radius: 8px;
-                padding: 15px;
-                margin-bottom: 20px;
-            }
-            .status p {
-                margin: 8px 0;
-                font-size: 16px;
-            }
-            h2 {
-                color: #34495e;
-                font-size: 18px;
-                margin-top: 20px;
-                margin-bottom: 10px;
-            }
-            .controls {
-                display: flex;
-                justify-content: space-around;
-                margin-bottom: 20px;
-            }
-            button {
-                background: #3498db;
-                color: white;
-                border: none;
-                padding: 12px 20px;
-                border-radius: 6px;
-                cursor: pointer;
-                font-size: 16px;
-                transition: background 0.3s, transform 0.1s;
-            }
-            button:hover {
-                background: #2980b9;
-                transform: translateY(-2px);
-            }
-            button:active {
-                transform: translateY(0);
-            }
-            .effect-buttons {
-                display: grid;
-                grid-template-columns: repeat(2, 1fr);
-                gap: 10px;
-                margin-bottom: 20px;
-            }
-            .effect-buttons button {
-                background: #bdc3c7;
-                color: #2c3e50;
-            }
-            .effect-buttons button:hover {
-                background: #95a5a6;
-            }
-            form {
-                display: flex;
-                flex-direction: column;
-                margin-bottom: 20px;
-            }
-            input[type="range"], input[type="number"], input[type="text"], input[type="color"], input[type="time"] {
-                padding: 10px;
-                margin-bottom: 10px;
-                border: 1px solid #ddd;
-                border-radius: 6px;
-                font-size: 16px;
-            }
-            input[type="submit"] {
-                background: #27ae60;
-                color: white;
-                border: none;
-                padding: 12px;
-                border-radius: 6px;
-                cursor: pointer;
-                font-size: 16px;
-                transition: background 0.3s;
-            }
-            input[type="submit"]:hover {
-                background: #219d54;
-            }
-            .slider-value {
-                text-align: center;
-                font-size: 14px;
-                margin-top: -10px;
-                margin-bottom: 10px;
-            }
-            @media (max-width: 400px) {
-                .controls {
-                    flex-direction: column;
-                }
-                .controls button {
-                    margin-bottom: 10px;
-                }
-                .effect-buttons {
-                    grid-template-columns: 1fr;
-                }
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>Young's Christmas Light Control!</h1>
-            <div class="status">
-                <p id="current_effect">Current Effect: {{ current_effect }}</p>
-                <p id="manual_on">Manual On: {{ manual_on }}</p>
-                <p id="manual_off">Manual Off: {{ manual_off }}</p>
-            </div>
-            <h2>Controls</h2>
-            <div class="controls">
-                <button onclick="callEndpoint('/on')">Turn On</button>
-                <button onclick="callEndpoint('/off')">Turn Off</button>
-            </div>
-            <h2>Music Control</h2>
-            <div class="controls">
-                <button onclick="callEndpoint('/play_music')">Play Christmas Music</button>
-                <button onclick="callEndpoint('/stop_music')">Stop Music</button>
-            </div>
-            <h2>Select Effect</h2>
-            <div class="effect-buttons">
-                <button onclick="callEndpoint('/effect/solid')">Solid</button>
-                <button onclick="callEndpoint('/effect/wipe')">Wipe</button>
-                <button onclick="callEndpoint('/effect/chase')">Chase</button>
-                <button onclick="callEndpoint('/effect/rainbow')">Rainbow</button>
-                <button onclick="callEndpoint('/effect/snake')">Snake</button>
-                <button onclick="callEndpoint('/effect/plague')">Plague Spread</button>
-                <button onclick="callEndpoint('/effect/random_multi')">Random Multi-Color</button>
-                <button onclick="callEndpoint('/effect/twinkle')">Twinkle Starfield</button>
-                <button onclick="callEndpoint('/effect/fire_flicker')">Fire Flicker</button>
-                <button onclick="callEndpoint('/effect/phase_out')">Phase Out</button>
-                <button onclick="callEndpoint('/effect/michigan')">Michigan</button>
-            </div>
-            <h2>Custom Solid Color</h2>
-            <form id="custom_color_form" onsubmit="submitForm(event, '/custom_color')">
-                <input type="color" name="color" value="#ff0000">
-                <input type="submit" value="Set Color">
-            </form>
-            <h2>Effect Speed (0.5-2.0)</h2>
-            <form id="effect_speed_form" onsubmit="submitForm(event, '/effect_speed')">
-                <input type="range" name="speed" min="0.5" max="2.0" step="0.1" value="1.0" oninput="updateSliderValue(this.value, 'speed_value')">
-                <p class="slider-value" id="speed_value">Value: 1.0</p>
-                <input type="submit" value="Set">
-            </form>
-            <h2>Set Brightness (0-255)</h2>
-            <form id="brightness_form" onsubmit="submitForm(event, '/brightness')">
-                <input type="range" id="brightness_slider" name="level" min="0" max="255" value="{{ brightness }}" oninput="updateSliderValue(this.value, 'brightness_value')">
-                <p class="slider-value" id="brightness_value">Value: {{ brightness }}</p>
-                <input type="submit" value="Set">
-            </form>
-            <h2>Set LED Count</h2>
-            <form id="led_count_form" onsubmit="submitForm(event, '/led_count')">
-                <input type="number" name="count" min="1" value="{{ led_count }}">
-                <input type="submit" value="Set">
-            </form>
-            <h2>Set Turn-Off Time</h2>
-            <form id="turn_off_time_form" onsubmit="submitForm(event, '/turn_off_time')">
-                <input type="time" name="time" value="23:00">
-                <input type="submit" value="Set">
-            </form>
-            <h2>Set Location</h2>
-            <form id="location_form" onsubmit="submitForm(event, '/location')">
-                <input type="text" name="name" value="{{ loc_name }}" placeholder="Name">
-                <input type="text" name="region" value="{{ loc_region }}" placeholder="Region">
-                <input type="text" name="timezone" value="{{ loc_timezone }}" placeholder="Timezone">
-                <input type="number" name="lat" step="any" value="{{ loc_lat }}" placeholder="Latitude">
-                <input type="number" name="lon" step="any" value="{{ loc_lon }}" placeholder="Longitude">
-                <input type="submit" value="Set">
-            </form>
-        </div>
-        <script>
-            const socket = io();
-
-            socket.on('update_state', function(state) {
-                document.getElementById('current_effect').innerText = 'Current Effect: ' + state.current_effect;
-                document.getElementById('manual_on').innerText = 'Manual On: ' + state.manual_on;
-                document.getElementById('manual_off').innerText = 'Manual Off: ' + state.manual_off;
-                document.getElementById('brightness_slider').value = state.brightness;
-                document.getElementById('brightness_value').innerText = 'Value: ' + state.brightness;
-                document.querySelector('#led_count_form input[name="count"]').value = state.led_count;
-                document.querySelector('#location_form input[name="name"]').value = state.loc_name;
-                document.querySelector('#location_form input[name="region"]').value = state.loc_region;
-                document.querySelector('#location_form input[name="timezone"]').value = state.loc_timezone;
-                document.querySelector('#location_form input[name="lat"]').value = state.loc_lat;
-                document.querySelector('#location_form input[name="lon"]').value = state.loc_lon;
-                document.querySelector('#custom_color_form input[name="color"]').value = rgbToHex(state.custom_solid_r, state.custom_solid_g, state.custom_solid_b);
-                document.querySelector('#effect_speed_form input[name="speed"]').value = state.effect_speed;
-                document.getElementById('speed_value').innerText = 'Value: ' + state.effect_speed;
-                const turnOffTime = `${state.turn_off_hour.toString().padStart(2, '0')}:${state.turn_off_minute.toString().padStart(2, '0')}`;
-                document.querySelector('#turn_off_time_form input[name="time"]').value = turnOffTime;
-            });
-
-            function rgbToHex(r, g, b) {
-                return "#" + ((1 << 24) + (r << 16) + (g << 8) + b).toString(16).slice(1);
-            }
-
-            function updateSliderValue(value, id) {
-                document.getElementById(id).innerText = 'Value: ' + value;
-            }
-
-            async function callEndpoint(endpoint) {
-                try {
-                    const response = await fetch(endpoint);
-                    if (response.ok) {
-                        console.log('Success');
-                    } else {
-                        console.error('Error');
-                    }
-                } catch (error) {
-                    console.error('Fetch error:', error);
-                }
-            }
-
-            async function submitForm(event, endpoint) {
-                event.preventDefault();
-                const form = event.target;
-                const formData = new FormData(form);
-                const params = new URLSearchParams(formData).toString();
-                try {
-                    const response = await fetch(endpoint + '?' + params);
-                    if (response.ok) {
-                        console.log('Success');
-                    } else {
-                        console.error('Error');
-                    }
-                } catch (error) {
-                    console.error('Fetch error:', error);
-                }
-            }
-        </script>
-    </body>
-    </html>
-    """
-    return render_template_string(html, current_effect=SELECTED_EFFECT, manual_on=manual_on, manual_off=manual_off,
-                                  brightness=LED_BRIGHTNESS, led_count=LED_COUNT,
-                                  loc_name=location.name, loc_region=location.region, loc_timezone=location.timezone,
-                                  loc_lat=location.latitude, loc_lon=location.longitude)
+    return serve_asset('index.html', 'private, no-cache')
+
+@app.route('/static/<name>')
+@auth.login_required
+def static_asset(name):
+    asset = ASSETS.get(name)
+    if asset is not None and request.args.get('v') == asset['etag']:
+        return serve_asset(name, f'private, max-age={ASSET_MAX_AGE}, immutable')
+    return serve_asset(name, 'private, no-cache')  # Unversioned URL: revalidate
 
 @app.route('/on')
 @auth.login_required
 def turn_on_via_web():
-    global manual_on, manual_off
-    manual_on = True
-    manual_off = False
-    if not (current_effect_thread and current_effect_thread.is_alive()):
-        start_effect()
-    broadcast_state()
-    return jsonify({"message": "Lights turned on!"}), 200
+    def work():
+        global manual_on, manual_off
+        manual_on = True
+        manual_off = False
+        if not effect_playing():
+            start_effect()  # Also cuts a turn-off wipe short
+        broadcast_state()
+        return "Lights turned on!"
+    return queue_command('on', work)
 
 @app.route('/off')
 @auth.login_required
 def turn_off_via_web():
-    global manual_on, manual_off
-    manual_on = False
-    manual_off = True
-    stop_current_effect()
-    turn_off(strip)
-    broadcast_state()
-    return jsonify({"message": "Lights turned off!"}), 200
+    def work():
+        global manual_on, manual_off
+        manual_on = False
+        manual_off = True
+        start_turn_off()
+        broadcast_state()
+        return turn_off_done()  # Done once the wipe has finished
+    return queue_command('off', work)
 
 @app.route('/effect/<effect_name>')
 @auth.login_required
 def set_effect(effect_name):
-    global SELECTED_EFFECT, current_effect_func
-    try:
+    if effect_name not in EFFECTS and effect_name not in ('zones', 'layers') and not effect_name.startswith('sequence:'):
+        return jsonify({"error": "Invalid effect!"}), 400
+    crossfade = request.args.get('crossfade', type=float)  # Optional crossfade seconds
+
+    def work():
+        global SELECTED_EFFECT, current_effect_func
         current_effect_func = get_effect_function(effect_name)
         SELECTED_EFFECT = effect_name
         save_config()
         if manual_on or (not manual_off and is_in_time_window()):
-            stop_current_effect()
+            start_effect(crossfade)
+        broadcast_state()
+        return f"Effect set to {effect_name}!"
+    return queue_command('effect', work)
+
+@app.route('/sequence/<name>')
+@auth.login_required
+def set_sequence(name):
+    def work():
+        global SELECTED_EFFECT, current_effect_func
+        try:
+            current_effect_func = get_sequence_function(name)
+        except ValueError:
+            raise ValueError("Invalid sequence!")
+        except OSError:
+            raise ValueError("Sequence not found!")
+        SELECTED_EFFECT = 'sequence:' + name
+        save_config()
+        if manual_on or (not manual_off and is_in_time_window()):
             start_effect()
         broadcast_state()
-        return jsonify({"message": f"Effect set to {effect_name}!"}), 200
-    except ValueError:
-        return jsonify({"error": "Invalid effect!"}), 400
+        return f"Sequence set to {name}!"
+    return queue_command('sequence', work)
+
+# Switch to a composite pseudo-effect ('zones' or 'layers') while it has
+# entries, or back to rainbow once its last entry is removed; restarts the
+# lights if they should be on now
+def apply_composite(name, entries):
+    global SELECTED_EFFECT, current_effect_func
+    if entries:
+        current_effect_func = get_effect_function(name)
+        SELECTED_EFFECT = name
+        if manual_on or (not manual_off and is_in_time_window()):
+            start_effect()
+    elif SELECTED_EFFECT == name:
+        stop_current_effect()
+        current_effect_func = get_effect_function('rainbow')
+        SELECTED_EFFECT = 'rainbow'
+        if manual_on or (not manual_off and is_in_time_window()):
+            start_effect()
+
+@app.route('/zones')
+@auth.login_required
+def get_zones():
+    return jsonify({"zones": ZONES}), 200
+
+# Add or replace a zone, then run the zones:
+# /zones/set?name=star&start=290&stop=300&effect=solid&speed=1.0&color=255,215,0
+@app.route('/zones/set')
+@auth.login_required
+def set_zone():
+    zone = {
+        'name': request.args.get('name', ''),
+        'start': request.args.get('start', -1, type=int),
+        'stop': request.args.get('stop', -1, type=int),
+        'effect': request.args.get('effect', ''),
+        'speed': request.args.get('speed', 1.0, type=float),
+        'params': {},
+    }
+    if request.args.get('color'):
+        try:
+            color = [int(x) for x in request.args['color'].split(',')]
+        except ValueError:
+            color = []
+        if len(color) != 3 or not all(0 <= x <= 255 for x in color):
+            return jsonify({"error": "Invalid color (r,g,b in 0-255)!"}), 400
+        zone['params']['color'] = color
+
+    def work():
+        global ZONES
+        error = zone_error(zone, ZONES)  # Checked here, against the zones as they are when it runs
+        if error:
+            raise ValueError(error)
+        ZONES = sorted([z for z in ZONES if z['name'] != zone['name']] + [zone], key=lambda z: z['start'])
+        apply_composite('zones', ZONES)
+        save_config()
+        broadcast_state()
+        return f"Zone {zone['name']} set to {zone['effect']}!"
+    return queue_command('zones/set', work)
+
+@app.route('/zones/remove')
+@auth.login_required
+def remove_zone():
+    name = request.args.get('name', '')
+
+    def work():
+        global ZONES
+        if not any(z['name'] == name for z in ZONES):
+            raise ValueError("Zone not found!")
+        ZONES = [z for z in ZONES if z['name'] != name]
+        apply_composite('zones', ZONES)
+        save_config()
+        broadcast_state()
+        return f"Zone {name} removed!"
+    return queue_command('zones/remove', work)
+
+@app.route('/layers')
+@auth.login_required
+def get_layers():
+    return jsonify({"layers": LAYERS}), 200
+
+# Add a layer on top of the stack (or update one in place), then run the layers:
+# /layers/set?name=stars&effect=twinkle&blend=add&opacity=0.8&speed=1.0
+@app.route('/layers/set')
+@auth.login_required
+def set_layer():
+    layer = {
+        'name': request.args.get('name', ''),
+        'effect': request.args.get('effect', ''),
+        'blend': request.args.get('blend', 'normal'),
+        'opacity': request.args.get('opacity', 1.0, type=float),
+        'speed': request.args.get('speed', 1.0, type=float),
+        'params': {},
+    }
+    if request.args.get('color'):
+        try:
+            color = [int(x) for x in request.args['color'].split(',')]
+        except ValueError:
+            color = []
+        if len(color) != 3 or not all(0 <= x <= 255 for x in color):
+            return jsonify({"error": "Invalid color (r,g,b in 0-255)!"}), 400
+        layer['params']['color'] = color
+
+    def work():
+        global LAYERS
+        error = layer_error(layer)  # Checked here, against the LED count as it is when it runs
+        if error:
+            raise ValueError(error)
+        names = [l['name'] for l in LAYERS]
+        if layer['name'] in names:
+            LAYERS = [layer if l['name'] == layer['name'] else l for l in LAYERS]
+        else:
+            LAYERS = LAYERS + [layer]
+        apply_composite('layers', LAYERS)
+        save_config()
+        broadcast_state()
+        return f"Layer {layer['name']} set to {layer['effect']}!"
+    return queue_command('layers/set', work)
+
+@app.route('/layers/remove')
+@auth.login_required
+def remove_layer():
+    name = request.args.get('name', '')
+
+    def work():
+        global LAYERS
+        if not any(l['name'] == name for l in LAYERS):
+            raise ValueError("Layer not found!")
+        LAYERS = [l for l in LAYERS if l['name'] != name]
+        apply_composite('layers', LAYERS)
+        save_config()
+        broadcast_state()
+        return f"Layer {name} removed!"
+    return queue_command('layers/remove', work)
 
 @app.route('/brightness')
 @auth.login_required
 def set_brightness():
     level = request.args.get('level', type=int)
     if level is not None and 0 <= level <= 255:
-        global LED_BRIGHTNESS
-        LED_BRIGHTNESS = level
-        strip.setBrightness(LED_BRIGHTNESS)
-        strip.show()
-        save_config()
-        broadcast_state()
-        return jsonify({"message": f"Brightness set to {level}!"}), 200
+        def work():
+            global LED_BRIGHTNESS
+            LED_BRIGHTNESS = level
+            build_output_lut()
+            render_loop.reshow()  # A running effect picks it up on its next frame
+            save_config()
+            broadcast_state()
+            return f"Brightness set to {level}!"
+        return queue_command('brightness', work)
     return jsonify({"error": "Invalid brightness level!"}), 400
 
+@app.route('/calibration')
+@auth.login_required
+def set_calibration():
+    gamma = request.args.get('gamma', GAMMA, type=float)
+    order = request.args.get('channel_order', CHANNEL_ORDER).upper()
+    try:
+        balance = tuple(float(x) for x in request.args.get('white_balance', ','.join(map(str, WHITE_BALANCE))).split(','))
+    except ValueError:
+        balance = ()
+    if 1.0 <= gamma <= 3.0 and len(balance) == 3 and all(0.0 <= x <= 1.0 for x in balance) and sorted(order) == ['B', 'G', 'R']:
+        def work():
+            global GAMMA, WHITE_BALANCE, CHANNEL_ORDER
+            GAMMA, WHITE_BALANCE, CHANNEL_ORDER = gamma, balance, order
+            build_output_lut()
+            render_loop.reshow()
+            save_config()
+            broadcast_state()
+            return "Calibration updated!"
+        return queue_command('calibration', work)
+    return jsonify({"error": "Invalid calibration (gamma 1.0-3.0, white_balance r,g,b in 0-1, channel_order a permutation of RGB)!"}), 400
+
 @app.route('/led_count')
 @auth.login_required
 def set_led_count():
     count = request.args.get('count', type=int)
     if count is not None and count > 0:
-        global LED_COUNT, strip
-        LED_COUNT = count
-        strip = PixelStrip(LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA, LED_INVERT, LED_BRIGHTNESS, LED_CHANNEL)
-        strip.begin()
-        save_config()
-        broadcast_state()
-        return jsonify({"message": f"LED count set to {count}!"}), 200
+        def work():
+            global LED_COUNT
+            LED_COUNT = count
+            render_loop.resize(LED_COUNT)  # New strip and framebuffer, in whichever process renders
+            if effect_playing():
+                start_effect()  # Re-create the effect for the new pixel count
+            save_config()
+            broadcast_state()
+            return f"LED count set to {count}!"
+        return queue_command('led_count', work)
     return jsonify({"error": "Invalid LED count!"}), 400
 
 @app.route('/location')
@@ -838,11 +2959,13 @@ def set_location():
     lat = request.args.get('lat', type=float)
     lon = request.args.get('lon', type=float)
     if all([name, region, timezone, lat is not None, lon is not None]):
-        global location
-        location = LocationInfo(name, region, timezone, lat, lon)
-        save_config()
-        broadcast_state()
-        return jsonify({"message": "Location updated!"}), 200
+        def work():
+            global location
+            location = LocationInfo(name, region, timezone, lat, lon)
+            save_config()
+            broadcast_state()
+            return "Location updated!"
+        return queue_command('location', work)
     return jsonify({"error": "Invalid location parameters!"}), 400
 
 @app.route('/turn_off_time')
@@ -852,14 +2975,17 @@ def set_turn_off_time():
     if time_str:
         try:
             hour, minute = map(int, time_str.split(':'))
-            global TURN_OFF_HOUR, TURN_OFF_MINUTE
-            TURN_OFF_HOUR = hour
-            TURN_OFF_MINUTE = minute
-            save_config()
-            broadcast_state()
-            return jsonify({"message": "Turn-off time updated!"}), 200
         except ValueError:
-            pass
+            hour = None
+        if hour is not None:
+            def work():
+                global TURN_OFF_HOUR, TURN_OFF_MINUTE
+                TURN_OFF_HOUR = hour
+                TURN_OFF_MINUTE = minute
+                save_config()
+                broadcast_state()
+                return "Turn-off time updated!"
+            return queue_command('turn_off_time', work)
     return jsonify({"error": "Invalid time format!"}), 400
 
 @app.route('/custom_color')
@@ -868,19 +2994,16 @@ def set_custom_color():
     color_hex = request.args.get('color')
     if color_hex and len(color_hex) == 7 and color_hex.startswith('#'):
         try:
-            r = int(color_hex[1:3], 16)
-            g = int(color_hex[3:5], 16)
-            b = int(color_hex[5:7], 16)
-            global CUSTOM_SOLID_COLOR
-            CUSTOM_SOLID_COLOR = (r, g, b)
-            save_config()
-            if SELECTED_EFFECT == 'solid' and (manual_on or (not manual_off and is_in_time_window())):
-                stop_current_effect()
-                start_effect()
-            broadcast_state()
-            return jsonify({"message": "Custom color set!"}), 200
+            color = (int(color_hex[1:3], 16), int(color_hex[3:5], 16), int(color_hex[5:7], 16))
         except ValueError:
-            pass
+            color = None
+        if color is not None:
+            def work():
+                params.set('solid.color', color)  # A running solid effect fades to it
+                save_config()
+                broadcast_state()
+                return "Custom color set!"
+            return queue_command('custom_color', work)
     return jsonify({"error": "Invalid color!"}), 400
 
 @app.route('/effect_speed')
@@ -888,69 +3011,187 @@ def set_custom_color():
 def set_effect_speed():
     speed = request.args.get('speed', type=float)
     if speed is not None and 0.5 <= speed <= 2.0:
-        global EFFECT_SPEED
-        EFFECT_SPEED = speed
-        save_config()
-        if current_effect_thread and current_effect_thread.is_alive():
-            stop_current_effect()
-            start_effect()
-        broadcast_state()
-        return jsonify({"message": f"Effect speed set to {speed}!"}), 200
+        def work():
+            params.set('speed', speed)  # Applies from the next frame, smoothed
+            save_config()
+            broadcast_state()
+            return f"Effect speed set to {speed}!"
+        return queue_command('effect_speed', work)
     return jsonify({"error": "Invalid speed (0.5-2.0)!"}), 400
 
-def connect_bluetooth():
-    global music_process  # If needed for coordination
+@app.route('/params')
+@auth.login_required
+def get_params():
+    return jsonify({"params": params.describe()}), 200
+
+# Set a live parameter: /param?name=solid.color&value=255,215,0 or
+# /param?name=speed&value=1.5
+@app.route('/param')
+@auth.login_required
+def set_param():
+    name = request.args.get('name', '')
+    raw = request.args.get('value', '')
+    try:
+        spec = PARAM_SPECS.get(name, {})
+        value = params.check(name, raw.split(',') if spec.get('type') == 'color' else raw)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def work():
+        params.set(name, value)
+        if 'global' in spec:
+            save_config()
+        broadcast_state()
+        return f"{name} set to {value}!"
+    return queue_command('param', work)
+
+BT_CONNECT_TIMEOUT_S = 15.0  # Give up on bluetoothctl connect after this long
+
+async def connect_bluetooth():
+    # Check if bluetoothctl exists
+    if not shutil.which('bluetoothctl'):
+        print("bluetoothctl not found—install bluez if missing.")
+        return False
     try:
-        # Check if bluetoothctl exists
-        if not shutil.which('bluetoothctl'):
-            print("bluetoothctl not found—install bluez if missing.")
+        # Connect without holding up other commands' bookkeeping
+        process = await asyncio.create_subprocess_exec('bluetoothctl', 'connect', BT_MAC,
+                                                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), BT_CONNECT_TIMEOUT_S)
+        except asyncio.TimeoutError:
+            process.kill()
+            print("Bluetooth connect timed out")
             return False
-        
-        # Connect (non-blocking)
-        connect_result = subprocess.run(['bluetoothctl', 'connect', BT_MAC], capture_output=True, text=True)
-        if 'Connection successful' in connect_result.stdout or 'already connected' in connect_result.stdout.lower():
+        stdout = stdout.decode(errors='replace')
+        if 'Connection successful' in stdout or 'already connected' in stdout.lower():
             print(f"Bluetooth connected to {BT_MAC}")
             return True
-        else:
-            print(f"Connection failed: {connect_result.stderr}")
-            return False
+        print(f"Connection failed: {stderr.decode(errors='replace')}")
+        return False
     except Exception as e:
         print(f"Bluetooth connect error: {e}")
         return False
-    
+
 @app.route('/play_music')
 @auth.login_required
 def play_music():
-    global music_process
-    if music_process and music_process.poll() is None:
-        return jsonify({"message": "Music already playing!"}), 200
-    
-    #Connect to Bluetooth first
-    if not connect_bluetooth():
-        return jsonify({"error": "Failed to connect Bluetooth speaker!"}), 500
-    
-    try:
-        music_process = subprocess.Popen(['mpg123', '-q', MUSIC_STREAM_URL])
-        return jsonify({"message": "Christmas music started!"}), 200
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    async def work():
+        global music_process
+        if music_process and music_process.poll() is None:
+            return "Music already playing!"
+
+        #Connect to Bluetooth first
+        if not await connect_bluetooth():
+            raise ValueError("Failed to connect Bluetooth speaker!")
+
+        try:
+            music_process = subprocess.Popen(['mpg123', '-q', MUSIC_STREAM_URL])
+        except OSError as e:
+            raise ValueError(str(e))
+        return "Christmas music started!"
+    return queue_command('play_music', work)
 
 # New endpoint: Stop music
 @app.route('/stop_music')
 @auth.login_required
 def stop_music():
-    global music_process
-    if music_process and music_process.poll() is None:
-        music_process.terminate()
-        music_process = None
-        return jsonify({"message": "Music stopped!"}), 200
-    return jsonify({"message": "No music playing!"}), 200
+    def work():
+        global music_process
+        if music_process and music_process.poll() is None:
+            music_process.terminate()
+            music_process = None
+            return "Music stopped!"
+        return "No music playing!"
+    return queue_command('stop_music', work)
+
+# Prometheus text lines for one histogram (cumulative buckets, sum, count)
+def histogram_lines(name, histogram, labels=''):
+    lines = []
+    cumulative = 0
+    for bound, c in zip(histogram.buckets + ('+Inf',), histogram.counts):
+        cumulative += c
+        lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+    braces = '{' + labels.rstrip(',') + '}' if labels else ''
+    lines.append(f'{name}_sum{braces} {histogram.sum}')
+    lines.append(f'{name}_count{braces} {histogram.count}')
+    return lines
+
+# Render-loop and control-route metrics in Prometheus text format, or a
+# compact JSON summary for the dashboard with ?format=json
+@app.route('/metrics')
+@auth.login_required
+def get_metrics():
+    if request.args.get('format') == 'json':
+        def ms(name, q):
+            value = metrics[name].quantile(q)
+            return None if value is None else round(value * 1000, 3)
+        return jsonify({
+            'fps': round(window_fps(), 1),
+            'render_p50_ms': ms('render_seconds', 0.5),
+            'render_p99_ms': ms('render_seconds', 0.99),
+            'show_p50_ms': ms('show_seconds', 0.5),
+            'show_p99_ms': ms('show_seconds', 0.99),
+            'switch_p99_ms': ms('effect_start_seconds', 0.99),
+            'late_frames': frame_totals['late_frames'],
+            'dropped_frames': frame_totals['dropped_frames'],
+            'skipped_pushes': output_stats['skipped_pushes'],
+            'preview_p99_ms': ms('preview_seconds', 0.99),
+            'preview_frames': preview_stats['frames'],
+            'preview_bytes': preview_stats['bytes'],
+        }), 200
+
+    lines = []
+    for name, histogram in metrics.items():
+        lines.append(f'# HELP lights_{name} {METRIC_HELP[name]}')
+        lines.append(f'# TYPE lights_{name} histogram')
+        lines.extend(histogram_lines(f'lights_{name}', histogram))
+        for q in (0.5, 0.99):
+            value = histogram.quantile(q)
+            if value is not None:
+                lines.append(f'lights_{name}_window{{quantile="{q}"}} {value}')
+    lines.append('# HELP lights_request_seconds Flask handler time by endpoint')
+    lines.append('# TYPE lights_request_seconds histogram')
+    for endpoint, histogram in sorted(request_metrics.items()):
+        lines.extend(histogram_lines('lights_request_seconds', histogram, f'endpoint="{endpoint}",'))
+    lines.append('# HELP lights_command_seconds Control command time from queued to done, by command')
+    lines.append('# TYPE lights_command_seconds histogram')
+    for name, histogram in sorted(command_metrics.items()):
+        lines.extend(histogram_lines('lights_command_seconds', histogram, f'command="{name}",'))
+    counters = [
+        ('frames_total', 'Frames rendered', frame_totals['frames']),
+        ('late_frames_total', 'Frames finished after their deadline', frame_totals['late_frames']),
+        ('dropped_frames_total', 'Frames skipped to catch up', frame_totals['dropped_frames']),
+        ('pushes_total', 'Frames pushed to the strip', output_stats['pushes']),
+        ('skipped_pushes_total', 'Unchanged frames not pushed', output_stats['skipped_pushes']),
+        ('state_deltas_total', 'State deltas sent to dashboards', state_sync_stats['deltas']),
+        ('state_snapshots_total', 'State snapshots sent to connecting dashboards', state_sync_stats['snapshots']),
+        ('state_resyncs_total', 'State snapshots sent to dashboards that fell behind', state_sync_stats['resyncs']),
+        ('state_drops_total', 'Dashboards disconnected for not acknowledging state', state_sync_stats['drops']),
+        ('config_saves_total', 'Config saves requested', config_stats['saves']),
+        ('config_writes_total', 'Config file writes', config_stats['writes']),
+        ('config_write_errors_total', 'Config file writes that failed', config_stats['write_errors']),
+        ('preview_frames_total', 'Live preview frames sent', preview_stats['frames']),
+        ('preview_bytes_total', 'Live preview bytes sent', preview_stats['bytes']),
+        ('preview_skipped_total', 'Live preview frames not sent to viewers with too many unacknowledged', preview_stats['skipped']),
+    ]
+    for name, help_text, value in counters:
+        lines.append(f'# HELP lights_{name} {help_text}')
+        lines.append(f'# TYPE lights_{name} counter')
+        lines.append(f'lights_{name} {value}')
+    lines.append('# HELP lights_fps Frames per second over the rolling window')
+    lines.append('# TYPE lights_fps gauge')
+    lines.append(f'lights_fps {window_fps()}')
+    return '\n'.join(lines) + '\n', 200, {'Content-Type': 'text/plain; version=0.0.4'}
 
 # Main scheduling logic
 def main_logic():
-    global manual_on, manual_off, current_effect_func, stop_event, current_effect_thread
+    global manual_on, manual_off, current_effect_func
     load_config()  # Load on start
-    current_effect_func = get_effect_function(SELECTED_EFFECT)
+    try:
+        current_effect_func = get_effect_function(SELECTED_EFFECT)
+    except (ValueError, OSError) as e:
+        print(f"Saved effect unavailable ({e}), falling back to rainbow")
+        current_effect_func = get_effect_function('rainbow')
     bootup = True #variable to determine if it just started
     while True:
         now = datetime.datetime.now(location.tzinfo)
@@ -966,7 +3207,7 @@ def main_logic():
         turn_off_time = now.replace(hour=TURN_OFF_HOUR, minute=TURN_OFF_MINUTE, second=0, microsecond=0)
         
         if turn_on_time > turn_off_time:
-            turn_off(strip)
+            turn_off()
             manual_on = False
             manual_off = False
             next_day = now + datetime.timedelta(days=1)
@@ -977,7 +3218,7 @@ def main_logic():
         should_be_on = manual_on or (not manual_off and turn_on_time <= now < turn_off_time)
         
         if should_be_on:
-            if not (current_effect_thread and current_effect_thread.is_alive()):
+            if not effect_playing():
                 start_effect()
             
             # Wait while should be on
@@ -986,12 +3227,10 @@ def main_logic():
             
             # If exited due to time, turn off unless manual_on
             if not manual_on:
-                stop_current_effect()
-                turn_off(strip)
+                turn_off()
         
         else:
-            stop_current_effect()
-            turn_off(strip)
+            turn_off()
             
             if now >= turn_off_time:
                 manual_on = False
@@ -1008,7 +3247,19 @@ def main_logic():
             time.sleep(sleep_seconds)
 
 # Main program entry
+# systemd stops the service with SIGTERM; shut down as on Ctrl+C so the
+# lights go off and pending config is written
+def handle_sigterm(signum, frame):
+    raise KeyboardInterrupt
+
 if __name__ == '__main__':
+    # Fork the render process before any other thread exists, with the
+    # config already loaded so it starts with the saved settings
+    if RENDER_PROCESS:
+        load_config()
+        render_loop = RenderProcess()
+    signal.signal(signal.SIGTERM, handle_sigterm)  # After the fork; the child is stopped by the parent
+
     # Start Flask/SocketIO in a separate thread
     flask_thread = threading.Thread(target=socketio.run, args=(app,), kwargs={'host': '0.0.0.0', 'port': 5000, 'debug': False,  'allow_unsafe_werkzeug': True, 'use_reloader': False})
     flask_thread.daemon = True
@@ -1022,7 +3273,7 @@ if __name__ == '__main__':
     try:
         main_logic()
     except KeyboardInterrupt:
-        stop_event.set()
-        if current_effect_thread and current_effect_thread.is_alive():
-            current_effect_thread.join()
-        turn_off(strip)
+        turn_off()
+        if RENDER_PROCESS:
+            render_loop.close()
+        config_store.flush()
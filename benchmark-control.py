@@ -0,0 +1,138 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+from benchmark_common import AUTH, HERE, free_port, load_lights, percentiles
+
+# Load test for the control API: serve the app on the null output backend
+# with the render loop running, then have N concurrent dashboard clients
+# click through the controls (effect switches, on/off, brightness, speed and
+# colour changes, metrics polling, the dashboard page) and record the latency of
+# every request. Reports p50/p95/p99/max handler latency per route and,
+# from the app's own command metrics, how long queued commands took to
+# complete. Point --script at an older automated-christmas.py to compare.
+
+# The requests one dashboard client cycles through, as (route label, path);
+# one cycle in ten also turns the lights off (a wipe of several seconds)
+def client_paths(lights, k):
+    effects = [name for name in lights.EFFECTS if name != 'solid']
+    return [('off', '/off')] * (k % 10 == 0) + [
+        ('effect', f'/effect/{effects[k % len(effects)]}'),
+        ('metrics', '/metrics?format=json'),
+        ('brightness', f'/brightness?level={100 + k % 100}'),
+        ('effect_speed', f'/effect_speed?speed={0.5 + (k % 16) / 10}'),
+        ('metrics', '/metrics?format=json'),
+        ('custom_color', f'/custom_color?color=%23{k % 256:02x}8040'),
+        ('on', '/on'),
+        ('dashboard', '/'),
+    ]
+
+def run_client(lights, base, k, deadline, think, samples, errors):
+    rng = np.random.default_rng(k)
+    n = 0
+    while time.monotonic() < deadline:
+        for route, path in client_paths(lights, k + n):
+            request = urllib.request.Request(base + path, headers={'Authorization': AUTH})
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    response.read()
+            except urllib.error.HTTPError as e:
+                errors.append((route, e.code))
+            except OSError as e:
+                errors.append((route, str(e)))
+            samples.setdefault(route, []).append(time.perf_counter() - started)
+            time.sleep(rng.uniform(0, think))
+        n += 1
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the control API')
+    parser.add_argument('--clients', type=int, default=50, help='Concurrent dashboard clients')
+    parser.add_argument('--seconds', type=float, default=20.0, help='Length of the run')
+    parser.add_argument('--think', type=float, default=0.2, help='Maximum pause between one client\'s requests, seconds')
+    parser.add_argument('--leds', type=int, default=300, help='LED count')
+    parser.add_argument('--script', default=os.path.join(HERE, 'automated-christmas.py'), help='Version of the app to test')
+    parser.add_argument('--output', default='bench_control.json', help='JSON results file')
+    args = parser.parse_args()
+
+    lights = load_lights(args.script)
+    lights.CONFIG_FILE = os.path.join(HERE, 'bench_control_config.json')  # Keep the real config untouched
+    lights.strip = lights.NullStrip(args.leds)
+    lights.framebuffer = lights.new_framebuffer(args.leds)
+    lights.LED_COUNT = args.leds
+    lights.manual_on = True
+    lights.current_effect_func = lights.get_effect_function('rainbow')
+    lights.start_effect()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)  # No access log
+    port = free_port()
+    server = threading.Thread(target=lights.socketio.run, args=(lights.app,), daemon=True,
+                              kwargs={'host': '127.0.0.1', 'port': port, 'debug': False,
+                                      'allow_unsafe_werkzeug': True, 'use_reloader': False})
+    server.start()
+    base = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(urllib.request.Request(base + '/params', headers={'Authorization': AUTH}), timeout=1).read()
+            break
+        except OSError:
+            time.sleep(0.05)
+
+    samples = {}
+    errors = []
+    deadline = time.monotonic() + args.seconds
+    clients = [threading.Thread(target=run_client, args=(lights, base, k, deadline, args.think, samples, errors))
+               for k in range(args.clients)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    time.sleep(1.0)  # Let queued commands finish
+
+    handlers = {route: percentiles(times) for route, times in sorted(samples.items())}
+    handlers['all'] = percentiles([t for times in samples.values() for t in times])
+    command_metrics = getattr(lights, 'command_metrics', {})
+    commands = {name: {'p50_ms': h.quantile(0.5) * 1000, 'p99_ms': h.quantile(0.99) * 1000}
+                for name, h in sorted(command_metrics.items()) if h.quantile(0.5) is not None}
+
+    print(f"{args.clients} clients, {args.seconds:.0f} s, {handlers['all']['count']} requests, {len(errors)} errors")
+    print(f"{'route':<14}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for route, r in handlers.items():
+        print(f"{route:<14}{r['count']:>7}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['max_ms']:>10.2f}")
+    if commands:
+        print("\nCommand completion (queued to done)")
+        for name, c in commands.items():
+            print(f"{name:<14}{c['p50_ms']:>17.2f}{c['p99_ms']:>20.2f}")
+
+    report = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'script': os.path.relpath(args.script, HERE),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'clients': args.clients,
+        'seconds': args.seconds,
+        'handlers': handlers,
+        'commands': commands,
+        'errors': len(errors),
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+    if hasattr(lights, 'config_store'):
+        lights.config_store.flush()  # So no write lands after the cleanup
+    for path in getattr(lights, 'config_versions', lambda: [lights.CONFIG_FILE])():
+        if os.path.exists(path):
+            os.remove(path)
+    os._exit(1 if errors else 0)  # The server thread does not stop on its own
+
+if __name__ == '__main__':
+    main()
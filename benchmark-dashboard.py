@@ -0,0 +1,166 @@
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import gzip
+import http.client
+import json
+import logging
+import os
+import platform
+import re
+import threading
+import time
+
+from benchmark_common import AUTH, HERE, free_port, load_lights
+
+# Dashboard page-load test over a slow link: serve the app on the null
+# output backend behind a throttling TCP proxy (fixed bandwidth, one-way
+# latency on every chunk and a round trip per new connection) and load the
+# dashboard like a browser: the page, then every asset it references in
+# parallel. A cold load starts with an empty cache; a warm load keeps the
+# responses and their validators from the cold one, skips anything still
+# fresh and revalidates the rest. Reports bytes on the wire and wall time
+# for both. Point --script at an older automated-christmas.py to compare.
+
+BROWSER_CONNECTIONS = 6  # Parallel connections per host, as browsers open
+
+# Throttling proxy on its own asyncio loop; counts bytes sent to the client
+class SlowLink:
+    def __init__(self, upstream_port, kbit, latency):
+        self.upstream_port = upstream_port
+        self.rate = kbit * 1000 / 8  # Bytes per second
+        self.latency = latency
+        self.bytes_down = 0
+        self.port = free_port()
+        ready = threading.Event()
+        threading.Thread(target=self.run, args=(ready,), daemon=True).start()
+        ready.wait()
+
+    def run(self, ready):
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(asyncio.start_server(self.accept, '127.0.0.1', self.port))
+        ready.set()
+        loop.run_until_complete(server.serve_forever())
+
+    async def accept(self, client_reader, client_writer):
+        await asyncio.sleep(2 * self.latency)  # TCP handshake
+        upstream_reader, upstream_writer = await asyncio.open_connection('127.0.0.1', self.upstream_port)
+        await asyncio.gather(self.pipe(client_reader, upstream_writer, False),
+                             self.pipe(upstream_reader, client_writer, True))
+
+    async def pipe(self, reader, writer, down):
+        try:
+            while True:
+                data = await reader.read(16384)
+                if not data:
+                    break
+                await asyncio.sleep(self.latency + len(data) / self.rate)
+                if down:
+                    self.bytes_down += len(data)
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+# One request like a browser makes it; returns (status, headers, body)
+def fetch(port, path, headers=None):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    connection.request('GET', path, headers=dict({'Authorization': AUTH, 'Accept-Encoding': 'br, gzip'}, **(headers or {})))
+    response = connection.getresponse()
+    body = response.read()
+    connection.close()
+    return response.status, {k.lower(): v for k, v in response.getheaders()}, body
+
+def page_assets(body, headers):
+    if headers.get('content-encoding') == 'gzip':
+        body = gzip.decompress(body)
+    return re.findall(r'(?:href|src)="([^"]+)"', body.decode('utf-8', errors='replace'))
+
+# Load the dashboard; `cache` maps path -> (headers, body) from a previous load
+def load_page(link, cache):
+    started = time.perf_counter()
+    bytes_before = link.bytes_down
+    requests = []
+
+    def get(path):
+        cached = cache.get(path)
+        if cached is not None:
+            cache_control = cached[0].get('cache-control', '')
+            max_age = re.search(r'max-age=(\d+)', cache_control)
+            if max_age and 'no-cache' not in cache_control and int(max_age.group(1)) > 0:
+                requests.append((path, 'cache'))
+                return cached
+            if 'etag' in cached[0]:
+                status, headers, body = fetch(link.port, path, {'If-None-Match': cached[0]['etag']})
+                requests.append((path, status))
+                if status == 304:
+                    return cached
+                cache[path] = (headers, body)
+                return cache[path]
+        status, headers, body = fetch(link.port, path)
+        requests.append((path, status))
+        cache[path] = (headers, body)
+        return cache[path]
+
+    headers, body = get('/')
+    assets = page_assets(body, headers)
+    external = [path for path in assets if '//' in path]  # Another host (a CDN); not reachable offline
+    with concurrent.futures.ThreadPoolExecutor(BROWSER_CONNECTIONS) as pool:
+        list(pool.map(get, [path for path in assets if path not in external]))
+    return {
+        'seconds': time.perf_counter() - started,
+        'bytes': link.bytes_down - bytes_before,
+        'requests': requests,
+        'external': external,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure dashboard page loads over a slow link')
+    parser.add_argument('--kbit', type=float, default=256, help='Link bandwidth, kbit/s')
+    parser.add_argument('--latency', type=float, default=0.1, help='One-way latency, seconds')
+    parser.add_argument('--script', default=os.path.join(HERE, 'automated-christmas.py'), help='Version of the app to test')
+    parser.add_argument('--output', default='bench_dashboard.json', help='JSON results file')
+    args = parser.parse_args()
+
+    lights = load_lights(args.script)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)  # No access log
+    port = free_port()
+    threading.Thread(target=lights.socketio.run, args=(lights.app,), daemon=True,
+                     kwargs={'host': '127.0.0.1', 'port': port, 'debug': False,
+                             'allow_unsafe_werkzeug': True, 'use_reloader': False}).start()
+    for _ in range(100):
+        try:
+            fetch(port, '/params')
+            break
+        except OSError:
+            time.sleep(0.05)
+    link = SlowLink(port, args.kbit, args.latency)
+
+    cache = {}
+    cold = load_page(link, cache)
+    warm = load_page(link, cache)
+    print(f"Link {args.kbit:.0f} kbit/s, {args.latency * 1000:.0f} ms one-way")
+    for name, result in (('cold', cold), ('warm', warm)):
+        print(f"{name}: {result['bytes']:>7} bytes  {result['seconds']:.2f} s  "
+              + ', '.join(f'{path.split("?")[0]} {status}' for path, status in result['requests']))
+        if result['external']:
+            print(f"      not loaded (external): {', '.join(result['external'])}")
+
+    report = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'script': os.path.relpath(args.script, HERE),
+        'python': platform.python_version(),
+        'link': {'kbit': args.kbit, 'latency_s': args.latency},
+        'cold': cold,
+        'warm': warm,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+    os._exit(0)  # The server threads do not stop on their own
+
+if __name__ == '__main__':
+    main()
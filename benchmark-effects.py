@@ -0,0 +1,285 @@
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmark_common import AUTH, HERE, load_lights, percentiles
+
+# Benchmark every registered effect headless: render a fixed number of frames
+# per LED count and speed, and record render/output time percentiles,
+# achieved FPS and memory per frame, plus the cost of the render-loop
+# metrics, the render loop's effect switch latency and its frame jitter
+# under web load, in-process and in a render process. Results are written
+# as JSON so runs from different versions can be compared with --compare.
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+# Time `frames` frames of one effect; effect time advances at the effect's
+# target FPS scaled by speed, exactly as the frame clock would drive it
+def bench_effect(lights, name, num_pixels, speed, frames):
+    fps = lights.EFFECT_FPS.get(name, lights.DEFAULT_FPS)
+    strip = lights.NullStrip(num_pixels)
+    frame = lights.new_framebuffer(num_pixels)
+    render = lights.EFFECTS[name](num_pixels)
+    render_times = []
+    output_times = []
+    started = time.perf_counter()
+    for k in range(frames):
+        t0 = time.perf_counter()
+        render(frame, k / fps * speed)
+        t1 = time.perf_counter()
+        lights.show_frame(strip, frame)
+        t2 = time.perf_counter()
+        render_times.append(t1 - t0)
+        output_times.append(t2 - t1)
+    elapsed = time.perf_counter() - started
+
+    # Memory pass (tracemalloc slows rendering, so it is kept out of the timings):
+    # peak traced memory over the run, the transient peak a frame allocates on
+    # top of what is live before it, and Python blocks retained per frame
+    render = lights.EFFECTS[name](num_pixels)
+    frame = lights.new_framebuffer(num_pixels)
+    tracemalloc.start()
+    transient = []
+    blocks_before = sys.getallocatedblocks()
+    for k in range(frames):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        render(frame, k / fps * speed)
+        lights.show_frame(strip, frame)
+        transient.append(tracemalloc.get_traced_memory()[1] - current)
+    blocks_after = sys.getallocatedblocks()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'effect': name,
+        'led_count': num_pixels,
+        'speed': speed,
+        'frames': frames,
+        'target_fps': fps,
+        'achieved_fps': frames / elapsed,
+        'render': percentiles(render_times),
+        'output': percentiles(output_times),
+        'peak_memory_bytes': peak,
+        'alloc_bytes_per_frame': float(np.mean(transient)),
+        'retained_blocks_per_frame': (blocks_after - blocks_before) / frames,
+    }
+
+# Cost the frame clock's instrumentation adds to one frame: three histogram
+# observations plus the timestamps taken around render() and show()
+def measure_metrics_overhead(lights, iterations=100000):
+    histograms = [lights.RollingHistogram() for _ in range(3)]
+    clock = time.monotonic
+    started = time.perf_counter()
+    for _ in range(iterations):
+        a = clock()
+        histograms[0].observe(clock() - a)
+        histograms[1].observe(clock() - a)
+        histograms[2].observe(a - a)
+    per_frame = (time.perf_counter() - started) / iterations
+    period = 1.0 / max(lights.EFFECT_FPS.values())
+    return {
+        'per_frame_us': per_frame * 1e6,
+        'fastest_frame_period_ms': period * 1000,
+        'percent_of_frame_period': per_frame / period * 100,
+    }
+
+# Switch effects on the live render loop at random points in the frame and
+# time each swap request to the new effect's first frame on the strip. The
+# budget is two frame periods of the effect being switched away from (the
+# loop swaps at the next frame boundary at the latest).
+def measure_switch_latency(lights, num_pixels, switches, crossfade=0.0):
+    lights.strip = lights.NullStrip(num_pixels)
+    lights.framebuffer = lights.new_framebuffer(num_pixels)
+    loop = lights.RenderLoop()
+    names = list(lights.EFFECTS)
+    rng = np.random.default_rng(0)
+    samples = []
+    over_budget = []
+    current = names[0]
+    loop.play(lights.get_effect_function(current))
+    time.sleep(0.1)
+    for k in range(switches):
+        name = names[(k + 1) % len(names)]
+        program = lights.get_effect_function(name)
+        time.sleep(rng.uniform(0, 0.05))  # Land anywhere in the frame period
+        budget = 2.0 / lights.EFFECT_FPS.get(current, lights.DEFAULT_FPS)
+        frames_before = lights.frame_totals['frames']
+        loop.play(program, crossfade)
+        while loop.last_switch_seconds is None or lights.frame_totals['frames'] == frames_before:
+            time.sleep(0.0005)
+        latency = loop.last_switch_seconds
+        loop.last_switch_seconds = None
+        samples.append(latency)
+        if latency > budget:
+            over_budget.append({'from': current, 'to': name, 'latency_ms': latency * 1000, 'budget_ms': budget * 1000})
+        current = name
+    loop.stop()
+    return {
+        'led_count': num_pixels,
+        'switches': switches,
+        'crossfade_s': crossfade,
+        'latency': percentiles(samples),
+        'over_budget': over_budget,
+    }
+
+# Frame timing jitter while the web app is busy: play rainbow and hammer
+# the Flask app from `clients` threads (metrics, params and state JSON),
+# then take the loop's recent frame intervals. Jitter is the distance of
+# each interval from the frame period. The loop is created before the load
+# starts, as the app does, since the render process is forked.
+def measure_render_jitter(lights, num_pixels, seconds, clients, separate):
+    lights.strip = lights.NullStrip(num_pixels)
+    lights.framebuffer = lights.new_framebuffer(num_pixels)
+    loop = lights.RenderProcess() if separate else lights.RenderLoop()
+    lights.render_loop = loop
+    loop.play(lights.get_effect_function('rainbow'))
+    time.sleep(0.5)
+    loop.recent_intervals()  # Settle, then measure only what follows
+    stop = threading.Event()
+    requests = [0]
+    headers = {'Authorization': AUTH}
+
+    def client():
+        web = lights.app.test_client()
+        while not stop.is_set():
+            for path in ('/metrics?format=json', '/params', '/metrics'):
+                web.get(path, headers=headers)
+                requests[0] += 1
+            json.dumps({'frame': np.asarray(lights.framebuffer).tolist()})
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    intervals = np.asarray(loop.recent_intervals()[-int(seconds * lights.EFFECT_FPS['rainbow']):])
+    if separate:
+        loop.stop(1.0)
+        loop.close()
+    else:
+        loop.stop(1.0)
+    lights.render_loop = None
+    period = 1.0 / lights.EFFECT_FPS['rainbow']
+    return {
+        'led_count': num_pixels,
+        'render_process': separate,
+        'clients': clients,
+        'requests_per_second': requests[0] / elapsed,
+        'frames': len(intervals),
+        'period_ms': period * 1000,
+        'jitter': percentiles(np.abs(intervals - period)),
+        'interval_stdev_ms': float(np.std(intervals) * 1000),
+    }
+
+def print_result(r):
+    print(f"{r['effect']:<14}{r['led_count']:>7}{r['speed']:>6.1f}"
+          f"{r['render']['p50_ms']:>10.3f}{r['render']['p99_ms']:>10.3f}{r['output']['p50_ms']:>10.3f}"
+          f"{r['achieved_fps']:>10.0f}{r['peak_memory_bytes'] / 1024:>10.0f}{r['alloc_bytes_per_frame'] / 1024:>10.1f}")
+
+# Print p50 render time and achieved FPS against a previous results file
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {(r['effect'], r['led_count'], r['speed']): r for r in json.load(f)['results']}
+    print(f"\nCompared with {baseline_path} (p50 render ms, achieved FPS; old -> new)")
+    for r in results:
+        old = baseline.get((r['effect'], r['led_count'], r['speed']))
+        if old is None:
+            continue
+        print(f"{r['effect']:<14}{r['led_count']:>7}{r['speed']:>6.1f}"
+              f"  {old['render']['p50_ms']:8.3f} -> {r['render']['p50_ms']:8.3f}"
+              f"  {old['achieved_fps']:8.0f} -> {r['achieved_fps']:8.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark LED effects headless')
+    parser.add_argument('--counts', default='300,1000,5000,20000', help='Comma-separated LED counts')
+    parser.add_argument('--speeds', default='0.5,1.0,2.0', help='Comma-separated EFFECT_SPEED values')
+    parser.add_argument('--frames', type=int, default=200, help='Frames per run')
+    parser.add_argument('--effects', default=None, help='Comma-separated effect names (default: all registered)')
+    parser.add_argument('--output', default='bench_effects.json', help='JSON results file')
+    parser.add_argument('--compare', default=None, help='Previous JSON results file to compare against')
+    parser.add_argument('--switches', type=int, default=100, help='Effect switches per LED count for the switch latency test (0 to skip)')
+    parser.add_argument('--jitter-seconds', type=float, default=5.0, help='Seconds of web load per render jitter run (0 to skip)')
+    parser.add_argument('--jitter-clients', type=int, default=8, help='Web client threads during the render jitter test')
+    args = parser.parse_args()
+
+    lights = load_lights()
+    effects = args.effects.split(',') if args.effects else list(lights.EFFECTS)
+    counts = [int(c) for c in args.counts.split(',')]
+    speeds = [float(s) for s in args.speeds.split(',')]
+
+    print(f"{'effect':<14}{'leds':>7}{'speed':>6}{'p50 ms':>10}{'p99 ms':>10}{'out ms':>10}{'fps':>10}{'peak KiB':>10}{'KiB/frm':>10}")
+    results = []
+    for name in effects:
+        for num_pixels in counts:
+            for speed in speeds:
+                result = bench_effect(lights, name, num_pixels, speed, args.frames)
+                print_result(result)
+                results.append(result)
+
+    overhead = measure_metrics_overhead(lights)
+    print(f"\nMetrics overhead: {overhead['per_frame_us']:.2f} us per frame, "
+          f"{overhead['percent_of_frame_period']:.3f}% of a {overhead['fastest_frame_period_ms']:.0f} ms frame")
+
+    # Before the switch latency runs, and render process first: it forks,
+    # which is best done before any render loop has started a thread
+    jitter = []
+    for separate in (True, False) if args.jitter_seconds else ():
+        result = measure_render_jitter(lights, counts[0], args.jitter_seconds, args.jitter_clients, separate)
+        jitter.append(result)
+        print(f"Render jitter {'render process' if separate else 'in-process   '} {result['led_count']:>6} LEDs, "
+              f"{result['requests_per_second']:.0f} req/s: p50 {result['jitter']['p50_ms']:.2f} ms, "
+              f"p99 {result['jitter']['p99_ms']:.2f} ms, max {result['jitter']['max_ms']:.2f} ms, "
+              f"stdev {result['interval_stdev_ms']:.2f} ms")
+
+    switching = []
+    for num_pixels in counts if args.switches else []:
+        for crossfade in (0.0, 0.5):
+            result = measure_switch_latency(lights, num_pixels, args.switches, crossfade)
+            switching.append(result)
+            print(f"Switch latency {num_pixels:>6} LEDs, crossfade {crossfade:.1f}s: "
+                  f"p50 {result['latency']['p50_ms']:.2f} ms, p99 {result['latency']['p99_ms']:.2f} ms, "
+                  f"max {result['latency']['max_ms']:.2f} ms, {len(result['over_budget'])} over budget")
+
+    report = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'metrics_overhead': overhead,
+        'results': results,
+        'switch_latency': switching,
+        'render_jitter': jitter,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+    failed = [r for r in switching if r['over_budget']]
+    if failed:
+        for r in failed:
+            for miss in r['over_budget']:
+                print(f"Switch over budget at {r['led_count']} LEDs: {miss['from']} -> {miss['to']} "
+                      f"{miss['latency_ms']:.2f} ms > {miss['budget_ms']:.2f} ms")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+import base64
+import importlib.util
+import os
+import socket
+
+import numpy as np
+
+# Helpers shared by the benchmark-*.py scripts, which import this module
+# from their own directory (hence the underscore in its name).
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+AUTH = 'Basic ' + base64.b64encode(b'admin:password123').decode()
+
+# Load automated-christmas.py (or an older copy of it) as a module on the
+# null output backend, baking in memory only so no spill files land in the
+# working directory
+def load_lights(path=os.path.join(HERE, 'automated-christmas.py')):
+    os.environ.setdefault('LIGHTS_BACKEND', 'null')
+    spec = importlib.util.spec_from_file_location('christmas_lights', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.BAKE_DIR = None
+    return module
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def percentiles(samples):
+    ms = np.asarray(samples) * 1000.0
+    return {
+        'count': len(ms),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'max_ms': float(ms.max()),
+    }
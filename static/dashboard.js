@@ -0,0 +1,184 @@
+const socket = io();
+
+// The server drops a client that stops acknowledging (e.g. a phone tab in
+// the background); the client only reconnects by itself after a transport
+// failure, so join again here and get a fresh snapshot
+socket.on('disconnect', function(reason) {
+    if (reason === 'io server disconnect') socket.connect();
+});
+
+// Synced state: a snapshot on connect, then deltas of the changed fields.
+// Every update is acknowledged with its version; the server sends the
+// next one only after that. Acks are volatile: one buffered across a
+// reconnect would refer to a version from before the new snapshot.
+let state = {};
+let stateVersion = null;
+
+socket.on('state_snapshot', function(snapshot) {
+    state = snapshot.state;
+    stateVersion = snapshot.version;
+    socket.volatile.emit('state_ack', {version: stateVersion});
+    showState(state);
+});
+
+socket.on('state_delta', function(delta) {
+    if (delta.base !== stateVersion) {
+        socket.volatile.emit('state_resync');
+        return;
+    }
+    Object.assign(state, delta.changes);
+    stateVersion = delta.version;
+    socket.volatile.emit('state_ack', {version: stateVersion});
+    showState(state);
+});
+
+function showState(state) {
+    document.getElementById('current_effect').innerText = 'Current Effect: ' + state.current_effect;
+    document.getElementById('manual_on').innerText = 'Manual On: ' + state.manual_on;
+    document.getElementById('manual_off').innerText = 'Manual Off: ' + state.manual_off;
+    document.getElementById('brightness_slider').value = state.brightness;
+    document.getElementById('brightness_value').innerText = 'Value: ' + state.brightness;
+    document.querySelector('#led_count_form input[name="count"]').value = state.led_count;
+    document.querySelector('#location_form input[name="name"]').value = state.loc_name;
+    document.querySelector('#location_form input[name="region"]').value = state.loc_region;
+    document.querySelector('#location_form input[name="timezone"]').value = state.loc_timezone;
+    document.querySelector('#location_form input[name="lat"]').value = state.loc_lat;
+    document.querySelector('#location_form input[name="lon"]').value = state.loc_lon;
+    document.querySelector('#custom_color_form input[name="color"]').value = rgbToHex(state.custom_solid_r, state.custom_solid_g, state.custom_solid_b);
+    document.querySelector('#effect_speed_form input[name="speed"]').value = state.effect_speed;
+    document.getElementById('speed_value').innerText = 'Value: ' + state.effect_speed;
+    const turnOffTime = `${state.turn_off_hour.toString().padStart(2, '0')}:${state.turn_off_minute.toString().padStart(2, '0')}`;
+    document.querySelector('#turn_off_time_form input[name="time"]').value = turnOffTime;
+    document.querySelector('#calibration_form input[name="gamma"]').value = state.gamma;
+    document.querySelector('#calibration_form input[name="white_balance"]').value = state.white_balance.join(',');
+    document.querySelector('#calibration_form input[name="channel_order"]').value = state.channel_order;
+}
+
+// Live preview: binary frames of what the strip shows, acknowledged so
+// the server never sends more than this page keeps up with. Layout: uint8
+// encoding (0 raw, 1 RLE, 2 delta), uint8, uint16 pixel count, uint32
+// sequence, then the encoded pixels (see PreviewStream in the server).
+const PREVIEW_FPS = 15;
+const previewCanvas = document.getElementById('preview');
+const previewStrip = document.createElement('canvas');  // One canvas pixel per LED, scaled up to draw
+let previewPixels = null;
+let previewSeq = null;
+
+socket.on('connect', function() {
+    previewSeq = null;
+    socket.emit('preview_subscribe', {fps: PREVIEW_FPS});
+});
+
+socket.on('preview', function(buffer) {
+    const view = new DataView(buffer);
+    const encoding = view.getUint8(0);
+    const count = view.getUint16(2, true);
+    const seq = view.getUint32(4, true);
+    const bytes = new Uint8Array(buffer, 8);
+    socket.volatile.emit('preview_ack', {seq: seq});
+    if (encoding === 2) {
+        if (previewSeq !== seq - 1 || previewPixels.length !== count * 3) {
+            socket.emit('preview_subscribe', {fps: PREVIEW_FPS});  // Missed a frame: start over from a keyframe
+            return;
+        }
+        const spans = view.getUint16(8, true);
+        let offset = 2 + spans * 4;
+        for (let k = 0; k < spans; k++) {
+            const start = view.getUint16(10 + k * 4, true);
+            const length = view.getUint16(12 + k * 4, true);
+            previewPixels.set(bytes.subarray(offset, offset + length * 3), start * 3);
+            offset += length * 3;
+        }
+    } else if (encoding === 1) {
+        previewPixels = new Uint8Array(count * 3);
+        let pixel = 0;
+        for (let offset = 0; offset < bytes.length; offset += 5) {
+            const length = bytes[offset] | (bytes[offset + 1] << 8);
+            for (let k = 0; k < length; k++, pixel++) previewPixels.set(bytes.subarray(offset + 2, offset + 5), pixel * 3);
+        }
+    } else {
+        previewPixels = bytes.slice(0, count * 3);
+    }
+    previewSeq = seq;
+    drawPreview(count);
+});
+
+function drawPreview(count) {
+    if (previewStrip.width !== count) {
+        previewStrip.width = count;
+        previewStrip.height = 1;
+    }
+    const context = previewStrip.getContext('2d');
+    const image = context.createImageData(count, 1);
+    for (let k = 0; k < count; k++) {
+        image.data[k * 4] = previewPixels[k * 3];
+        image.data[k * 4 + 1] = previewPixels[k * 3 + 1];
+        image.data[k * 4 + 2] = previewPixels[k * 3 + 2];
+        image.data[k * 4 + 3] = 255;
+    }
+    context.putImageData(image, 0, 0);
+    const target = previewCanvas.getContext('2d');
+    target.imageSmoothingEnabled = false;
+    target.drawImage(previewStrip, 0, 0, previewCanvas.width, previewCanvas.height);
+}
+
+// Control requests only queue the work; this reports how it went
+socket.on('command_done', function(done) {
+    document.getElementById('command_status').innerText = done.ok ?
+        done.message : 'Error: ' + done.error;
+    if (!done.ok) console.error('Command ' + done.command + ' (' + done.name + ') failed:', done.error);
+});
+
+async function refreshMetrics() {
+    try {
+        const response = await fetch('/metrics?format=json');
+        if (!response.ok) return;
+        const m = await response.json();
+        document.getElementById('metrics').innerText =
+            `FPS ${m.fps} | render p50 ${m.render_p50_ms} / p99 ${m.render_p99_ms} ms | ` +
+            `show p50 ${m.show_p50_ms} ms | late ${m.late_frames} | dropped ${m.dropped_frames} | ` +
+            `skipped pushes ${m.skipped_pushes} | preview p99 ${m.preview_p99_ms} ms`;
+    } catch (error) {
+        console.error('Metrics error:', error);
+    }
+}
+refreshMetrics();
+setInterval(refreshMetrics, 5000);
+
+function rgbToHex(r, g, b) {
+    return "#" + ((1 << 24) + (r << 16) + (g << 8) + b).toString(16).slice(1);
+}
+
+function updateSliderValue(value, id) {
+    document.getElementById(id).innerText = 'Value: ' + value;
+}
+
+async function callEndpoint(endpoint) {
+    try {
+        const response = await fetch(endpoint);
+        if (response.ok) {
+            console.log('Success');
+        } else {
+            console.error('Error');
+        }
+    } catch (error) {
+        console.error('Fetch error:', error);
+    }
+}
+
+async function submitForm(event, endpoint) {
+    event.preventDefault();
+    const form = event.target;
+    const formData = new FormData(form);
+    const params = new URLSearchParams(formData).toString();
+    try {
+        const response = await fetch(endpoint + '?' + params);
+        if (response.ok) {
+            console.log('Success');
+        } else {
+            console.error('Error');
+        }
+    } catch (error) {
+        console.error('Fetch error:', error);
+    }
+}